@@ -1,6 +1,9 @@
+import os
 import pickle
 import sys
 from collections import namedtuple
+from functools import lru_cache
+from typing import List
 
 import numpy as np
 
@@ -8,7 +11,9 @@ from JicBitstream import JicBitstream
 from knowledge import PU_ADDR
 from knowledge2 import BLK_LOC_START_BIT, UNKNW_BLK_LOWER_LIM, UNKWN_BLK_NR
 
-sys.path.append("../gen_bitstreams")
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.append(os.path.join(MODULE_DIR, "..", "gen_bitstreams"))
 from PinInfoParser import PinInfoParser
 
 IOSTD_REL_TO_PU = np.array(
@@ -48,6 +53,88 @@ IOclassifierOut = namedtuple(
     "IOclassifierOut", ["inp", "out", "pu", "io_std", "term", "diff"]
 )
 
+# columnar counterpart of IOclassifierOut, "term" is empty if not applicable
+IOCLASSIFIER_TABLE_DTYPE = np.dtype(
+    [
+        ("pin", "U8"),
+        ("inp", bool),
+        ("out", bool),
+        ("pu", bool),
+        ("io_std", "U8"),
+        ("term", "U16"),
+        ("diff", bool),
+    ]
+)
+
+
+def _feat_indices(vals):
+    """Positions of the relative addresses `vals` in IOSTD_REL_TO_PU"""
+    return np.array([np.where(IOSTD_REL_TO_PU == val)[0][0] for val in vals])
+
+
+# The resources below are loaded on first use (unpickling the decision tree
+# imports scikit-learn) and shared by all the IOclassifier instances.
+
+
+@lru_cache(maxsize=None)
+def _load_pickle(filename):
+    with open(os.path.join(MODULE_DIR, filename), "rb") as f:
+        return pickle.load(f)
+
+
+@lru_cache(maxsize=None)
+def _load_pins_info(filename, target_pkg):
+    parser = PinInfoParser(filename, target_pkg)
+    return parser.get_all_pins()
+
+
+def _tree_to_lut(dtree, nr_feat):
+    """Evaluate a decision tree on all the binary inputs
+
+    The features are bits, so the tree is flattened into a lookup table
+    indexed by the packed feature word (feature `i` is bit `i`).
+
+    Returns:
+        array with shape (2 ** nr_feat, dtree.n_outputs_), same as `predict`
+    """
+
+    words = np.arange(2 ** nr_feat)
+    X = (words[:, np.newaxis] >> np.arange(nr_feat)) & 1
+
+    tree = dtree.tree_
+    node = np.zeros(len(words), dtype=int)
+    while True:
+        inner = tree.children_left[node] != -1
+        if not np.any(inner):
+            break
+        go_left = X[words, tree.feature[node]] <= tree.threshold[node]
+        next_node = np.where(
+            go_left, tree.children_left[node], tree.children_right[node]
+        )
+        node = np.where(inner, next_node, node)
+
+    value = tree.value[node]
+    classes = dtree.classes_ if dtree.n_outputs_ > 1 else [dtree.classes_]
+    lut = np.stack(
+        [classes[k][np.argmax(value[:, k], axis=1)] for k in range(dtree.n_outputs_)],
+        axis=1,
+    )
+
+    lut_ref = dtree.predict(X).reshape(lut.shape)
+    assert np.array_equal(lut, lut_ref), "lookup table does not match the tree"
+
+    return lut
+
+
+@lru_cache(maxsize=None)
+def _load_iostd_lut():
+    """Returns feature indices of the IO standard decoder and the lookup table"""
+
+    idxs_iostd = _feat_indices(_load_pickle("IDX_OUT_DT.p"))
+    lut = _tree_to_lut(_load_pickle("out_std_dtc.p"), len(idxs_iostd))
+    lut.flags.writeable = False
+    return idxs_iostd, lut
+
 
 class IOclassifier:
     IDX_PU = 0
@@ -60,41 +147,56 @@ class IOclassifier:
     # [0, 0, 1] = def, [1, 1 0] = class 1 or 2
     IDX_SSTL_TERM = [-256, -224, 544]
 
-    IDX_OUT_DT = pickle.load(open("IDX_OUT_DT.p", "rb"))
-    dtree_out = pickle.load(open("out_std_dtc.p", "rb"))
-
-    STRATIXV_PIN_INFO = "../../resources/5sgsd5.txt"
-    parser = PinInfoParser(STRATIXV_PIN_INFO, "F1517")
-    pins_info = parser.get_all_pins()
+    STRATIXV_PIN_INFO = os.path.join(MODULE_DIR, "..", "..", "resources", "5sgsd5.txt")
     IDX_IO_STD_RX_DIFF = 1664
     IDX_IO_STD_TX_DIFF = 1696
 
     idx_vec = IOSTD_REL_TO_PU
 
-    @staticmethod
-    def _offs_cor(addr, pin):
-        addr -= np.sum(addr > BLK_LOC_START_BIT) * 64
-        unknw_blk_lower_lim = UNKNW_BLK_LOWER_LIM[pin]
-        unknw_blk_nr = UNKWN_BLK_NR[pin]
+    # positions of the features in IOSTD_REL_TO_PU
+    _idx_pu = _feat_indices([IDX_PU])[0]
+    _idx_input = _feat_indices([IDX_INPUT_ACT_B])[0]
+    _idx_input_diff = _feat_indices([IDX_INPUT_ACT_B_DIFF])[0]
+    _idxs_output = _feat_indices(IDX_OUTPUT)
+    _idxs_sstl_term = _feat_indices(IDX_SSTL_TERM)
+    _idx_rx_diff = _feat_indices([IDX_IO_STD_RX_DIFF])[0]
+    _idx_tx_diff = _feat_indices([IDX_IO_STD_TX_DIFF])[0]
 
-        if addr > unknw_blk_lower_lim:
-            addr -= unknw_blk_nr * 1344
+    SSTL_TERM_DEF = np.array([0, 0, 1])
+    SSTL_TERM_CL1_2 = np.array([1, 1, 0])
 
-        return addr
+    # feature (bit) addresses, cached per pin
+    _feat_addrs_cache = {}
 
     @staticmethod
-    def _offs_cor_reverse(addr, pin):
-        unknw_blk_lower_lim = UNKNW_BLK_LOWER_LIM[pin]
-        unknw_blk_nr = UNKWN_BLK_NR[pin]
+    def _nr_blks_below(addr):
+        """Same as `np.sum(addr > BLK_LOC_START_BIT)`, for an array of addresses"""
+        return np.searchsorted(BLK_LOC_START_BIT, addr, side="left")
+
+    @classmethod
+    def _to_logical(cls, addr, unknw_blk_lower_lim, unknw_blk_nr):
+        addr = addr - cls._nr_blks_below(addr) * 64
+        return np.where(
+            addr > unknw_blk_lower_lim, addr - unknw_blk_nr * 1344, addr
+        )
 
-        if addr > unknw_blk_lower_lim:
-            addr += unknw_blk_nr * 1344
+    @classmethod
+    def _to_physical(cls, addr, unknw_blk_lower_lim, unknw_blk_nr):
+        addr = np.where(
+            addr > unknw_blk_lower_lim, addr + unknw_blk_nr * 1344, addr
+        )
+
+        est_addr = addr + cls._nr_blks_below(addr) * 64
+        est_addr = addr + cls._nr_blks_below(est_addr) * 64
+        return addr + cls._nr_blks_below(est_addr) * 64
 
-        est_addr = addr + (np.sum(addr > BLK_LOC_START_BIT) * 64)
-        est_addr = addr + (np.sum(est_addr > BLK_LOC_START_BIT) * 64)
-        addr += np.sum(est_addr > BLK_LOC_START_BIT) * 64
+    @classmethod
+    def _offs_cor(cls, addr, pin):
+        return cls._to_logical(addr, UNKNW_BLK_LOWER_LIM[pin], UNKWN_BLK_NR[pin])
 
-        return addr
+    @classmethod
+    def _offs_cor_reverse(cls, addr, pin):
+        return cls._to_physical(addr, UNKNW_BLK_LOWER_LIM[pin], UNKWN_BLK_NR[pin])
 
     @staticmethod
     def get_indices(arr, vals):
@@ -106,75 +208,153 @@ class IOclassifier:
     def __init__(self):
         pass
 
+    @property
+    def IDX_OUT_DT(self):
+        return _load_pickle("IDX_OUT_DT.p")
+
+    @property
+    def dtree_out(self):
+        return _load_pickle("out_std_dtc.p")
+
+    @property
+    def pins_info(self):
+        return _load_pins_info(self.STRATIXV_PIN_INFO, "F1517")
+
     def classify(self, jic: JicBitstream, pin_lst):
-        return [self._classify_pin(jic, pin) for pin in pin_lst]
+        table = self.classify_table(jic, pin_lst)
+
+        return [
+            IOclassifierOut(
+                inp=bool(row["inp"]),
+                out=row["out"],
+                pu=bool(row["pu"]),
+                io_std=row["io_std"],
+                term=str(row["term"]) if row["term"] else None,
+                diff=bool(row["diff"]),
+            )
+            for row in table
+        ]
+
+    def classify_table(self, jic: JicBitstream, pin_lst):
+        """Classify all the pins at once
+
+        Returns:
+            structured array (IOCLASSIFIER_TABLE_DTYPE), one row per pin
+        """
+
+        feats = jic.get_els(self.get_feat_addrs(pin_lst)).astype(int)
+        return self.decode_features(feats, pin_lst)
+
+    def decode_features(self, feats, pin_lst):
+        """Decode features with shape (len(pin_lst), len(IOSTD_REL_TO_PU))"""
+
+        pins_info = self.pins_info
+        is_rx = np.array(
+            [pins_info[pin].tx_rx_ch.find("DIFFIO_RX") == 0 for pin in pin_lst],
+            dtype=bool,
+        )
+
+        table = np.zeros(len(pin_lst), dtype=IOCLASSIFIER_TABLE_DTYPE)
+        table["pin"] = pin_lst
+        table["pu"] = feats[:, self._idx_pu] != 0
+        table["out"] = np.any(feats[:, self._idxs_output], axis=1)
 
-    def _classify_pin(self, jic, pin):
-        feat_addrs = IOSTD_REL_TO_PU + self._offs_cor(PU_ADDR[pin], pin)
-        feat_addrs = np.array(
-            [self._offs_cor_reverse(addr, pin) for addr in feat_addrs]
+        diff = np.where(
+            is_rx, feats[:, self._idx_rx_diff], feats[:, self._idx_tx_diff]
         )
-        feat = jic.get_els(feat_addrs).astype(int)
-        has_pu = self._has_pull_up(feat)
-        has_output = self._has_output(feat)
-        diff = self._has_diff(feat, pin)
-        has_input = self._has_input(feat, diff)
-        io_std = self._get_iostd(feat)
-
-        if io_std[0][0] == "S":
-            sstl_term = self._get_sstl_term(feat)
-        else:
-            sstl_term = None
-
-        return IOclassifierOut(
-            inp=has_input,
-            out=has_output,
-            pu=has_pu,
-            io_std=io_std[0],
-            term=sstl_term,
-            diff=diff,
+        table["diff"] = diff != 0
+
+        input_act_b = np.where(
+            diff, feats[:, self._idx_input_diff], feats[:, self._idx_input]
+        )
+        table["inp"] = input_act_b == 0
+
+        io_std = self.get_iostd_batch(feats)[:, 0]
+        table["io_std"] = io_std
+
+        feat_sstl_term = feats[:, self._idxs_sstl_term]
+        term = np.where(
+            np.all(feat_sstl_term == self.SSTL_TERM_DEF, axis=1),
+            "SSTL, term",
+            np.where(
+                np.all(feat_sstl_term == self.SSTL_TERM_CL1_2, axis=1),
+                "SSTL cl1/2, term",
+                "no term",
+            ),
         )
+        table["term"] = np.where(np.char.startswith(io_std, "S"), term, "")
+
+        return table
+
+    def get_feat_addrs(self, pin_lst):
+        """Bit addresses of the features, shape (len(pin_lst), len(IOSTD_REL_TO_PU))"""
+
+        cache = self._feat_addrs_cache
+        missing = [pin for pin in dict.fromkeys(pin_lst) if pin not in cache]
+
+        if missing:
+            pu_addr = np.array([PU_ADDR[pin] for pin in missing])[:, np.newaxis]
+            lim = np.array([UNKNW_BLK_LOWER_LIM[pin] for pin in missing])[:, np.newaxis]
+            nr = np.array([UNKWN_BLK_NR[pin] for pin in missing])[:, np.newaxis]
+
+            feat_addrs = IOSTD_REL_TO_PU + self._to_logical(pu_addr, lim, nr)
+            feat_addrs = self._to_physical(feat_addrs, lim, nr)
+            feat_addrs.flags.writeable = False
+
+            for pin, addrs in zip(missing, feat_addrs):
+                cache[pin] = addrs
+
+        feat_addrs = np.zeros((len(pin_lst), len(IOSTD_REL_TO_PU)), dtype=int)
+        for i, pin in enumerate(pin_lst):
+            feat_addrs[i] = cache[pin]
+        return feat_addrs
+
+    def get_features(self, jics: List[JicBitstream], pin_lst):
+        """Gather the feature bits of all pins from many bitstreams
+
+        The address matrix is computed once and each bitstream is read with
+        a single gather.
+
+        Returns:
+            array with shape (len(jics), len(pin_lst), len(IOSTD_REL_TO_PU))
+        """
+
+        feat_addrs = self.get_feat_addrs(pin_lst)
+        feats = np.zeros((len(jics),) + feat_addrs.shape, dtype=np.uint8)
+        for i, jic in enumerate(jics):
+            feats[i] = jic.get_els(feat_addrs)
+        return feats
+
+    def get_iostd_feats(self, io_std):
+        """Feature bits decoded as `io_std` (see `get_iostd_batch`)
+
+        Returns:
+            positions of the bits in IOSTD_REL_TO_PU, and all the values of
+            the bits (one row per value) which are decoded as `io_std`
+        """
+
+        idxs_iostd, lut = _load_iostd_lut()
+        words = np.flatnonzero(lut[:, 0] == io_std)
+        if words.shape[0] == 0:
+            names = ", ".join(np.unique(lut[:, 0]).astype(str))
+            raise ValueError(f"unknown io_std {io_std}, one of: {names}")
+
+        bits = (words[:, np.newaxis] >> np.arange(len(idxs_iostd))) & 1
+        return idxs_iostd, bits
+
+    def get_iostd_batch(self, feats):
+        """Decode the IO standard from the features
+
+        Same as `dtree_out.predict`, but done with a table lookup.
+
+        Args:
+            feats: feature bits, shape (..., len(IOSTD_REL_TO_PU))
+
+        Returns:
+            array with shape (..., dtree_out.n_outputs_)
+        """
 
-    def _has_pull_up(self, feat):
-        pu_idx = np.where(self.idx_vec == self.IDX_PU)[0][0]
-        return bool(feat[pu_idx])
-
-    def _has_output(self, feat):
-        out_idxs = self.get_indices(self.idx_vec, self.IDX_OUTPUT)
-        return np.any(feat[out_idxs])
-
-    def _has_input(self, feat, diff):
-        if diff:
-            in_idx = np.where(self.idx_vec == self.IDX_INPUT_ACT_B_DIFF)[0][0]
-        else:
-            in_idx = np.where(self.idx_vec == self.IDX_INPUT_ACT_B)[0][0]
-        feat_input = feat[in_idx]
-        return not bool(feat_input)
-
-    def _get_iostd(self, feat):
-        idxs_iostd = self.get_indices(self.idx_vec, self.IDX_OUT_DT)
-        feat_iostd = feat[idxs_iostd]
-        return self.dtree_out.predict(feat_iostd.reshape(1, -1))[0]
-
-    def _get_sstl_term(self, feat):
-        idxs_sstl_term = self.get_indices(self.idx_vec, self.IDX_SSTL_TERM)
-        feat_sstl_term = feat[idxs_sstl_term]
-        DEF_TERM = np.array([0, 0, 1])
-        CL1_2_TERM = np.array([1, 1, 0])
-
-        # pylint: disable=no-else-return
-        if np.array_equal(feat_sstl_term, DEF_TERM):
-            return "SSTL, term"
-        elif np.array_equal(feat_sstl_term, CL1_2_TERM):
-            return "SSTL cl1/2, term"
-        else:
-            return "no term"
-
-    def _has_diff(self, feat, pin):
-        if self.pins_info[pin].tx_rx_ch.find("DIFFIO_RX") == 0:
-            diff_idx = np.where(self.idx_vec == self.IDX_IO_STD_RX_DIFF)[0][0]
-        else:
-            diff_idx = np.where(self.idx_vec == self.IDX_IO_STD_TX_DIFF)[0][0]
-
-        feat_diff = feat[diff_idx]
-        return bool(feat_diff)
+        idxs_iostd, lut = _load_iostd_lut()
+        feat_iostd = np.asarray(feats)[..., idxs_iostd].astype(int)
+        words = feat_iostd @ (1 << np.arange(len(idxs_iostd)))
+        return lut[words]
@@ -1,42 +1,440 @@
+import hashlib
 import os
 import zipfile
+from collections import OrderedDict
+from threading import Lock
 
 import numpy as np
 
+import JicCrc
+from JicDecompressor import (
+    BLOCK_DTYPE,
+    HEADER_SIZE,
+    MAGIC_SIZE,
+    JicDecompressor,
+    find_blocks,
+    find_decomp_enable,
+)
+
+# number of 64-bit words XOR-ed at once in diff_bit_pos
+DIFF_CHUNK_WORDS = 1 << 16
+
+# default memory budget of the decoded bitstream cache
+JIC_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# suggested location of the on-disk cache, see JicBitstreamZip.CACHE_DIR
+JIC_DISK_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "results", ".jic_cache"
+)
+
+
+def _bit_pos(diff_bytes, byte_pos):
+    """Bit addresses of the set bits in `diff_bytes`, located at `byte_pos`"""
+
+    bits = np.unpackbits(diff_bytes).reshape(-1, 8)
+    byte_idx, bit_idx = np.nonzero(bits)
+    return byte_pos[byte_idx] * 8 + bit_idx
+
+
+def diff_bit_pos(a, b):
+    """Positions of the bits which differ between two packed bitstreams
+
+    The bitstreams are XOR-ed as 64-bit words (in chunks, to keep the
+    temporary arrays small) and only the non-zero words are unpacked.
+
+    Args:
+        a, b: packed bitstreams (np.uint8 arrays) of the same length
+
+    Returns:
+        sorted array of bit addresses, same as `np.nonzero` on unpacked arrays
+    """
+
+    if a.shape != b.shape:
+        raise ValueError(f"bitstream size mismatch: {a.shape} != {b.shape}")
+
+    nr_words = a.shape[0] // 8
+    a64 = a[: nr_words * 8].view(np.uint64)
+    b64 = b[: nr_words * 8].view(np.uint64)
+
+    pos = []
+    for start in range(0, nr_words, DIFF_CHUNK_WORDS):
+        end = start + DIFF_CHUNK_WORDS
+        diff = a64[start:end] ^ b64[start:end]
+        word_pos = np.nonzero(diff)[0]
+        if word_pos.size == 0:
+            continue
+
+        diff_bytes = diff[word_pos].view(np.uint8).reshape(-1, 8)
+        byte_pos = (start + word_pos)[:, np.newaxis] * 8 + np.arange(8)
+        nz = diff_bytes != 0
+        pos.append(_bit_pos(diff_bytes[nz], byte_pos[nz]))
+
+    tail = nr_words * 8
+    diff = a[tail:] ^ b[tail:]
+    byte_pos = np.nonzero(diff)[0]
+    pos.append(_bit_pos(diff[byte_pos], byte_pos + tail))
+
+    return np.concatenate(pos)
+
 
 class JicBitstream:
-    def __init__(self, jic_filename):
-        jic = open(jic_filename, "rb").read()
-        jic = np.frombuffer(jic, dtype=np.uint8)
-        self.jic_uint8 = jic
-        jic = np.unpackbits(jic)
-        self.jic = jic
+    """JIC bitstream, stored packed (8 bits per byte)
+
+    Bit addresses follow `np.unpackbits` ordering, i.e. bit 0 is the MSB of
+    the first byte. The bits are never materialized, `get_els` and `diff_pos`
+    work directly on the packed bytes.
+
+    By default the bit addresses refer to the raw file (`jic_uint8`, same
+    bytes as `jic`). Compressed images (e.g. a factory .jic) are only
+    decompressed when asked for: `image_uint8` is the decompressed image, and
+    with `decompress` the bit addresses (`get_els`, `diff_pos`, `set_els`)
+    refer to it. `get_els` then only decodes the blocks containing the
+    requested bits; the block table is saved next to the .jic (see
+    `index_filename`), so later lookups do not need to scan the stream.
+    """
+
+    # number of processes used to decompress a compressed image
+    DECOMP_JOBS = 1
+
+    # save (and use) the block index of compressed images next to the .jic
+    BLOCK_INDEX = True
+
+    # image used for the bit addresses, see `__init__`
+    sel = -1
+    decompress = False
+
+    jic_filename = None
+    _compressed = None
+    _decompressor = None
+    _image = None
+    _index_ok = False
+    _blocks = None
+
+    def __init__(
+        self, jic_filename, mmap=True, sel=-1, write=False, decompress=False
+    ):
+        """
+        Args:
+            jic_filename: path to the .jic file
+            mmap: memory-map the file instead of reading it, only the pages
+                which are accessed are read from the disk
+            sel: index of the image if the .jic is compressed (a factory
+                .jic contains two), the last one by default
+            write: changes (see `set_els`) are written back to the file,
+                call `flush` when done; needs `mmap`
+            decompress: the bit addresses refer to the decompressed image
+                (`image_uint8`) if the .jic is compressed
+        """
+
+        if write and not mmap:
+            raise ValueError("write needs mmap")
+
+        if mmap:
+            # "c" is copy-on-write, changes are never written back to the file
+            mode = "r+" if write else "c"
+            self.jic_uint8 = np.memmap(jic_filename, dtype=np.uint8, mode=mode)
+        else:
+            jic = open(jic_filename, "rb").read()
+            self.jic_uint8 = np.frombuffer(jic, dtype=np.uint8)
+
+        self.jic_filename = jic_filename
+        self.sel = sel
+        self.decompress = decompress
+
+    @property
+    def is_compressed(self):
+        """True if the first block after the selected header enables compression"""
+
+        if self._compressed is None and self._load_index():
+            # only compressed images have an index
+            self._compressed = True
+
+        if self._compressed is None:
+            jjjj_locs = self.find_jjjj_seqs()
+            if jjjj_locs.shape[0] == 0:
+                self._compressed = False
+            else:
+                blk_loc = jjjj_locs[self.sel] + MAGIC_SIZE + HEADER_SIZE
+                self._compressed = find_decomp_enable(self.jic_uint8, blk_loc) >= 0
+        return self._compressed
+
+    @property
+    def decompressor(self):
+        """JicDecompressor of the selected image, the stream is scanned once"""
+
+        if self._decompressor is None:
+            self._decompressor = JicDecompressor(self, self.sel, self.DECOMP_JOBS)
+        return self._decompressor
+
+    @property
+    def image_uint8(self):
+        """Decompressed image (decompressed once), `jic_uint8` if not compressed"""
+
+        if not self.is_compressed:
+            return self.jic_uint8
+
+        if self._image is None:
+            self._image = self.decompressor.decompress()
+            self._save_index()
+        return self._image
+
+    @property
+    def bits_uint8(self):
+        """Packed image the bit addresses refer to (see `decompress`)"""
+        return self.image_uint8 if self.decompress else self.jic_uint8
+
+    @property
+    def blocks(self):
+        """Block table (BLOCK_DTYPE) of the image, addresses in `bits_uint8`"""
+
+        if self.decompress and self.is_compressed:
+            return self.decompressor.blocks
+
+        if self._blocks is None:
+            jjjj_locs = self.find_jjjj_seqs()
+            if jjjj_locs.shape[0] == 0:
+                self._blocks = np.zeros(0, dtype=BLOCK_DTYPE)
+            else:
+                blk_loc = jjjj_locs[self.sel] + MAGIC_SIZE + HEADER_SIZE
+                self._blocks = find_blocks(self.jic_uint8, blk_loc)
+        return self._blocks
+
+    def bad_blocks(self):
+        """Indices (into `blocks`) of the blocks with a wrong CRC"""
+        return JicCrc.bad_blocks(self.bits_uint8, self.blocks)
+
+    @property
+    def index_filename(self):
+        """Block index of a compressed image, None if not used"""
+
+        if not self.BLOCK_INDEX or self.jic_filename is None:
+            return None
+        return f"{self.jic_filename}.blocks{self.sel}.npz"
+
+    def _index_key(self):
+        _, mtime_ns, size = JicCache.key(self.jic_filename)
+        return (mtime_ns, size)
+
+    def _load_index(self):
+        filename = self.index_filename
+        if filename is None or not os.path.exists(filename):
+            return False
+
+        self._index_ok = self.decompressor.load_index(filename, self._index_key())
+        return self._index_ok
+
+    def _save_index(self):
+        filename = self.index_filename
+        if filename is None or self._index_ok:
+            return
+
+        try:
+            self.decompressor.save_index(filename, self._index_key())
+        except OSError:
+            # e.g. a read-only directory, the index is only an optimization
+            return
+        self._index_ok = True
+
+    @property
+    def jic(self):
+        """Unpacked bitstream (one bit per element)
+
+        Only kept for interactive use, the array is unpacked on every access;
+        always the raw file, same bytes as `jic_uint8`.
+        """
+        return np.unpackbits(self.jic_uint8)
 
     def diff_pos(self, other):
-        diff = self.jic ^ other.jic
-        nz_els = np.nonzero(diff)
-        return nz_els
+        return (diff_bit_pos(self.bits_uint8, other.bits_uint8),)
 
     def get_els(self, addrs):
-        return self.jic[addrs]
+        addrs = np.asarray(addrs)
+        if self.decompress and self._image is None and self.is_compressed:
+            byte_vals = self.decompressor.read(addrs >> 3)
+            self._save_index()
+        else:
+            byte_vals = self.bits_uint8[addrs >> 3]
+        return ((byte_vals >> (7 - (addrs & 7))) & 1).astype(np.uint8)
+
+    def set_els(self, addrs, vals, fix_crc=True):
+        """Sets the bits at `addrs` to `vals`
+
+        Only the bits which change are flipped, the CRCs of their blocks are
+        then updated from the CRC syndromes of the flipped bits (see
+        `JicCrc.patch_crcs`). The file is only changed if it was opened with
+        `write`; with `decompress`, a compressed image is decompressed and
+        the decompressed image is patched (in memory).
+
+        Args:
+            addrs: bit addresses (if an address is repeated, the first
+                value is used)
+            vals: new values of the bits (0 or 1)
+            fix_crc: update the CRCs of the changed blocks
+
+        Returns:
+            addresses of the flipped bits
+        """
+
+        addrs = np.asarray(addrs, dtype=np.int64)
+        vals = np.broadcast_to(np.asarray(vals, dtype=np.uint8), addrs.shape)
+        addrs, first = np.unique(addrs, return_index=True)
+        vals = vals.reshape(-1)[first]
+
+        flips = addrs[self.get_els(addrs) != vals]
+        image = self._writable_image()
+        np.bitwise_xor.at(image, flips >> 3, (0x80 >> (flips & 7)).astype(np.uint8))
+
+        if fix_crc:
+            JicCrc.patch_crcs(image, self.blocks, flips)
+
+        return flips
+
+    def flush(self):
+        """Writes the changes back to the file (if opened with `write`)"""
+
+        if isinstance(self.jic_uint8, np.memmap):
+            self.jic_uint8.flush()
+
+    def _writable_image(self):
+        """`bits_uint8`, copied first if it is read-only (e.g. shared by the cache)"""
+
+        image = self.bits_uint8
+        if image.flags.writeable:
+            return image
+
+        image = image.copy()
+        if self.decompress and self.is_compressed:
+            self._image = image
+        else:
+            self.jic_uint8 = image
+        return image
 
     def find_jjjj_seqs(self):
-        JJJJ = np.array([ord('j')]*4, dtype=np.uint8)
+        """Start locations (byte addresses) of all "jjjj" sequences"""
+
+        # bytes.find is much faster than comparing the whole array 4 times
+        jic = self.jic_uint8.tobytes()
+
+        locs = []
+        loc = jic.find(b"jjjj")
+        while loc >= 0:
+            locs.append(loc)
+            loc = jic.find(b"jjjj", loc + 1)
+
+        return np.array(locs, dtype=np.intp)
+
+
+class JicCache:
+    """LRU cache of decoded bitstreams, keyed by (path, mtime, size)
+
+    The cached arrays are read-only and shared between all the
+    `JicBitstreamZip` objects opened from the same file.
+    """
+
+    def __init__(self, max_bytes=JIC_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
 
-        possible_locs = np.where(self.jic_uint8 == ord('j'))[0]
-        found_locs = []
+    @staticmethod
+    def key(filename):
+        stat = os.stat(filename)
+        return (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
 
-        for loc in possible_locs:
-            if np.all(self.jic_uint8[loc:loc+4] == JJJJ):
-                found_locs.append(loc)
+    def get(self, key):
+        with self._lock:
+            arr = self._entries.get(key)
+            if arr is not None:
+                self._entries.move_to_end(key)
+            return arr
+
+    def put(self, key, arr):
+        if arr.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+
+            self._entries[key] = arr
+            self.nbytes += arr.nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# process-wide cache, used by JicBitstreamZip
+jic_cache = JicCache()
 
-        return found_locs
 
 class JicBitstreamZip(JicBitstream):
-    def __init__(self, zip_filename):
+    JIC_MEMBER = "base_project.jic"
+
+    # directory with the decoded .jic files, named by the hash of the zip;
+    # the on-disk cache is disabled if this is None
+    CACHE_DIR = None
+
+    def __init__(self, zip_filename, cache=True):
+        """
+        Args:
+            zip_filename: path to the results .zip
+            cache: use the process-wide cache of decoded bitstreams (and
+                the on-disk cache, if `CACHE_DIR` is set)
+        """
+
+        key = JicCache.key(zip_filename) if cache else None
+        jic = jic_cache.get(key) if cache else None
+
+        if jic is None:
+            if cache and self.CACHE_DIR is not None:
+                jic = self._read_jic_cached(zip_filename)
+            else:
+                jic = self._read_jic(zip_filename)
+
+            if cache:
+                jic_cache.put(key, jic)
+
+        self.jic_uint8 = jic
+
+    @classmethod
+    def _read_jic(cls, zip_filename):
         with zipfile.ZipFile(zip_filename, mode="r") as zip:
-            jic = zip.open("base_project.jic", "r").read()
-            jic = np.frombuffer(jic, dtype=np.uint8)
-            self.jic_uint8 = jic
-            jic = np.unpackbits(jic)
-            self.jic = jic
+            jic = zip.read(cls.JIC_MEMBER)
+        return np.frombuffer(jic, dtype=np.uint8)
+
+    @classmethod
+    def _read_jic_cached(cls, zip_filename):
+        """Memory-maps the decoded .jic from `CACHE_DIR`, decodes it first if needed"""
+
+        cache_filename = os.path.join(cls.CACHE_DIR, f"{_file_sha1(zip_filename)}.jic")
+
+        if not os.path.exists(cache_filename):
+            jic = cls._read_jic(zip_filename)
+
+            # write to a temp file first, another process may be reading the cache
+            os.makedirs(cls.CACHE_DIR, exist_ok=True)
+            tmp_filename = f"{cache_filename}.{os.getpid()}.tmp"
+            with open(tmp_filename, "wb") as f:
+                f.write(jic.tobytes())
+            os.replace(tmp_filename, cache_filename)
+
+        return np.memmap(cache_filename, dtype=np.uint8, mode="r")
+
+
+def _file_sha1(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
@@ -0,0 +1,210 @@
+"""CRC16 (Modbus) of the .jic blocks
+
+Every block ends with a CRC16 (Modbus) of the block, stored little-endian,
+so the CRC of a whole (intact) block is 0. The CRC is table-driven and
+computed for all the blocks of the same size at once, one column of
+16-bit words at a time.
+
+The CRC is linear: flipping a bit of a block flips the bits of its CRC
+given by the syndrome of the bit (`crc16_syndromes`), so a patched block
+never needs to be hashed again (`patch_crcs`).
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from JicDecompressor import BLK_SIZE, BLK_TYPE_ALT3, CRC_SIZE
+
+CRC16_MODBUS_POLY = 0xA001
+CRC16_MODBUS_INIT = 0xFFFF
+
+# number of blocks processed at once by block_crcs
+CRC_CHUNK_BLOCKS = 4096
+
+# block types with a CRC, the (12-byte) end block is not checked
+CRC_BLK_TYPES = [t for t in range(5) if t != BLK_TYPE_ALT3]
+
+
+def _build_crc_table(nr_bits):
+    """CRC register after shifting in `nr_bits` zero bits, for every register value"""
+
+    crc = np.arange(1 << nr_bits, dtype=np.uint32)
+    for _ in range(nr_bits):
+        crc = (crc >> 1) ^ (CRC16_MODBUS_POLY * (crc & 1))
+    return crc.astype(np.uint16)
+
+
+# one byte at a time (for an odd size) and two bytes at a time
+CRC16_TABLE = _build_crc_table(8)
+CRC16_TABLE_WORD = _build_crc_table(16)
+
+
+def crc16_rows(data, init=CRC16_MODBUS_INIT):
+    """CRC16 (Modbus) of every row of a 2-D np.uint8 array"""
+
+    data = np.asarray(data, dtype=np.uint8)
+    nr_rows, size = data.shape
+    crc = np.full(nr_rows, init, dtype=np.uint16)
+
+    # the register is 16 bits wide, so a 16-bit word is shifted in at once
+    words = np.ascontiguousarray(data[:, : size & ~1]).view("<u2").T.copy()
+    idx = np.empty_like(crc)
+    for word in words:
+        np.bitwise_xor(crc, word, out=idx)
+        np.take(CRC16_TABLE_WORD, idx, out=crc)
+
+    if size & 1:
+        crc = (crc >> 8) ^ np.take(CRC16_TABLE, (crc ^ data[:, -1]) & 0xFF)
+
+    return crc
+
+
+def crc16(data, init=CRC16_MODBUS_INIT):
+    """CRC16 (Modbus) of a byte array, e.g. `crc16(b"123456789") == 0x4B37`"""
+
+    data = np.frombuffer(bytes(data), dtype=np.uint8)
+    return int(crc16_rows(data[np.newaxis, :], init)[0])
+
+
+@lru_cache(maxsize=None)
+def crc16_syndromes(size):
+    """Change of the CRC of a `size`-byte block (CRC included) for every bit
+
+    Returns:
+        read-only np.uint16 array, indexed by the bit address in the block
+        (`np.unpackbits` ordering), the CRC bits themselves are not included
+    """
+
+    data_size = size - CRC_SIZE
+
+    # a single set byte at the end of the data, then moved to the front one
+    # zero byte at a time (rows: byte offset, columns: bit, MSB first)
+    syn = np.zeros((data_size, 8), dtype=np.uint16)
+    crc = CRC16_TABLE[0x80 >> np.arange(8)]
+    for offs in range(data_size - 1, -1, -1):
+        syn[offs] = crc
+        crc = (crc >> 8) ^ CRC16_TABLE[crc & 0xFF]
+
+    syn = syn.reshape(-1)
+    syn.flags.writeable = False
+    return syn
+
+
+def patch_crcs(image, blocks, bit_addrs, blk_types=CRC_BLK_TYPES):
+    """Updates the CRCs of the blocks after the bits at `bit_addrs` were flipped
+
+    Args:
+        image: image the blocks are in (np.uint8), changed in place
+        blocks: block table (BLOCK_DTYPE)
+        bit_addrs: flipped bits (unique), bits outside of the checked blocks
+            or in the CRCs themselves are ignored
+
+    Returns:
+        indices (into `blocks`) of the patched blocks
+    """
+
+    bit_addrs = np.asarray(bit_addrs, dtype=np.int64)
+    byte_addrs = bit_addrs >> 3
+
+    blk_idx = np.searchsorted(blocks["out_loc"], byte_addrs, side="right") - 1
+    valid = blk_idx >= 0
+    blk_idx, bit_addrs = blk_idx[valid], bit_addrs[valid]
+
+    blks = blocks[blk_idx]
+    in_data = (bit_addrs >> 3) < blks["crc_loc"]
+    in_data &= np.isin(blks["type"], blk_types)
+    blk_idx, bit_addrs, blks = blk_idx[in_data], bit_addrs[in_data], blks[in_data]
+
+    delta = np.zeros(blocks.shape[0], dtype=np.uint16)
+    for size in np.unique(blks["size"]).tolist():
+        sel = blks["size"] == size
+        bit_offs = bit_addrs[sel] - 8 * blks["out_loc"][sel]
+        np.bitwise_xor.at(delta, blk_idx[sel], crc16_syndromes(size)[bit_offs])
+
+    patched = np.flatnonzero(delta)
+    crc_locs = blocks["crc_loc"][patched]
+    image[crc_locs] ^= (delta[patched] & 0xFF).astype(np.uint8)
+    image[crc_locs + 1] ^= (delta[patched] >> 8).astype(np.uint8)
+    return patched
+
+
+def _block_rows(image, locs, size):
+    """Blocks of `size` bytes at `locs`, as rows of a 2-D array"""
+
+    rows = np.empty((locs.shape[0], size), dtype=np.uint8)
+
+    # blocks usually follow each other, every run is copied at once
+    brk = (np.flatnonzero(np.diff(locs) != size) + 1).tolist()
+    for first, end in zip([0] + brk, brk + [locs.shape[0]]):
+        loc = int(locs[first])
+        rows[first:end] = image[loc : loc + (end - first) * size].reshape(-1, size)
+
+    return rows
+
+
+def block_crcs(image, blocks):
+    """CRC16 (Modbus) of every block, including its CRC (0 if intact)
+
+    Args:
+        image: image the blocks are in (np.uint8)
+        blocks: block table (BLOCK_DTYPE), only `out_loc` and `size` are used
+
+    Returns:
+        np.uint16 array, one element per block
+    """
+
+    crcs = np.zeros(blocks.shape[0], dtype=np.uint16)
+    for size in np.unique(blocks["size"]).tolist():
+        idx = np.flatnonzero(blocks["size"] == size)
+        for first in range(0, idx.shape[0], CRC_CHUNK_BLOCKS):
+            chunk = idx[first : first + CRC_CHUNK_BLOCKS]
+            locs = blocks["out_loc"][chunk]
+            crcs[chunk] = crc16_rows(_block_rows(image, locs, size))
+
+    return crcs
+
+
+def bad_blocks(image, blocks, blk_types=CRC_BLK_TYPES):
+    """Indices (into `blocks`) of the blocks with a wrong CRC
+
+    Args:
+        image: image the blocks are in (np.uint8)
+        blocks: block table (BLOCK_DTYPE)
+        blk_types: types of the blocks which are checked
+    """
+
+    checked = np.flatnonzero(np.isin(blocks["type"], blk_types))
+    crcs = block_crcs(image, blocks[checked])
+    return checked[crcs != 0]
+
+
+def crc_addr_starts(diff_pos, period=8 * BLK_SIZE, crc_bits=8 * CRC_SIZE):
+    """First bits of the CRCs which changed, found from diff positions
+
+    Every changed block also changes its CRC, which is at the same position
+    in every block, so the CRC position (modulo the block `period`) is the
+    byte-aligned window of `crc_bits` with the most diff positions. Same as
+    `knowledge.CHKSUM_ADDR_START` for the diffs in `knowledge.CHKSUM_ADDR`.
+
+    Args:
+        diff_pos: bit addresses of the changed bits (e.g. `diff_bit_pos`)
+
+    Returns:
+        sorted bit addresses
+    """
+
+    pos = np.unique(np.asarray(diff_pos, dtype=np.int64))
+    if pos.shape[0] == 0:
+        return pos
+
+    phase = np.sort(pos % period)
+
+    # a changed bit is in the first or in the second byte of the CRC
+    first_byte = phase - phase % 8
+    cand = np.unique(np.concatenate([first_byte, first_byte - 8]) % period)
+    counts = np.searchsorted(phase, cand + crc_bits) - np.searchsorted(phase, cand)
+    crc_phase = cand[np.argmax(counts)]
+
+    offs = (pos - crc_phase) % period
+    return np.unique(pos[offs < crc_bits] - offs[offs < crc_bits])
@@ -0,0 +1,923 @@
+"""Decompressor for compressed .jic images
+
+Vectorized replacement for the `JicCompressedBlockIterator` from
+bitstream_analysis/04_jic_decompression.ipynb, the output is byte-identical
+to the `factory_decompress*.jic` files produced by the notebook.
+
+The compressed stream is a stream of nibbles (low nibble of a byte first).
+Each group starts with a control nibble, bit `i` of the control nibble tells
+if the `i`-th output nibble is a literal (stored after the control nibble)
+or zero, so every group decodes to 4 nibbles (2 bytes). The stream starts
+uncompressed, the first block starting with 0x4F enables the decompression.
+
+Instead of decoding one nibble at a time, the start of every group is found
+for a large window of the stream at once (`find_group_starts`), the groups
+are then decoded with a lookup table (`decode_groups`). The decompression
+is done in three steps:
+
+1. the group starts are found, window by window (in parallel if `jobs` > 1)
+2. the stream is scanned block by block, this only needs the group starts
+   and the block headers; the headers of many default blocks are checked
+   at once, only the ALT* blocks are parsed one by one
+3. the blocks are decoded, in chunks of blocks (in parallel if `jobs` > 1)
+   into a preallocated (shared) output buffer
+"""
+
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+MAGIC_SIZE = 4
+HEADER_SIZE = 77660
+BLK_SIZE = 1188
+BLK_SIZE_ALT = 2332
+BLK_SIZE_ALT2 = 192
+BLK_SIZE_ALT3 = 12
+
+ALT_BLK_HEADER = bytes([0xC1, 0x68, 0x3, 0x0])
+ALT2_BLK_HEADER = bytes([0xEC, 0x64, 0x0, 0x0])
+ALT3_BLK_HEADER = bytes([0xAE, 0xFB, 0x0, 0x0])
+ALT4_BLK_HEADER = bytes([0xC1, 0x68, 0x31, 0x0])
+
+# size of the ALT4 header, stored uncompressed in front of the payload
+ALT4_HDR_SIZE = 2
+
+# first (direct) byte of the block which enables the decompression
+DECOMP_ENABLE = 0x4F
+
+# number of bytes in front of the first "jjjj" which are not part of the output
+PREFIX_TRIM = 14
+
+BLK_TYPE_DEFAULT = 0
+BLK_TYPE_ALT = 1
+BLK_TYPE_ALT2 = 2
+BLK_TYPE_ALT3 = 3
+BLK_TYPE_ALT4 = 4
+
+# every block ends with a CRC16 (Modbus) of the block
+CRC_SIZE = 2
+
+# one entry per block; `in_nib` is the nibble address of the first group, or
+# -1 if the block is stored uncompressed at `in_loc`; `crc_loc` is the output
+# address of the CRC
+BLOCK_DTYPE = np.dtype(
+    [
+        ("type", np.uint8),
+        ("size", np.int32),
+        ("in_loc", np.int64),
+        ("in_nib", np.int64),
+        ("out_loc", np.int64),
+        ("crc_loc", np.int64),
+    ]
+)
+
+# version of the block index files, see `JicDecompressor.save_index`
+INDEX_VERSION = 1
+
+# nibbles processed at once by find_group_starts
+GROUP_WINDOW = 1 << 23
+
+# segment size of find_group_starts, in nibbles
+GROUP_SEG_SIZE = 1 << 12
+
+# number of blocks checked at once for block headers
+BLK_BATCH = 256
+
+# number of blocks decoded at once (one task of the process pool)
+DECODE_BLOCKS = 512
+
+
+def _build_group_lut():
+    """Decoded group (little-endian) for the 5 nibbles starting at the control nibble"""
+
+    words = np.arange(1 << 20, dtype=np.uint32)
+    ctrl = words & 0xF
+
+    dec = np.zeros_like(words)
+    lit_idx = np.zeros_like(words)
+    for i in range(4):
+        is_lit = (ctrl >> i) & 1
+        lit = (words >> (4 + 4 * lit_idx)) & 0xF
+        dec |= (lit * is_lit) << (4 * i)
+        lit_idx += is_lit
+
+    return dec.astype(np.uint16)
+
+
+GROUP_LUT = _build_group_lut()
+
+# group length (in nibbles) for each control nibble
+GROUP_LEN = np.array([1 + bin(i).count("1") for i in range(16)], dtype=np.uint8)
+
+_GROUP_LEN_LST = GROUP_LEN.tolist()
+_HDR_ALT = int.from_bytes(ALT_BLK_HEADER, "little")
+_HDR_ALT2 = int.from_bytes(ALT2_BLK_HEADER, "little")
+_HDR_ALT3 = int.from_bytes(ALT3_BLK_HEADER, "little")
+_HDR_ALT4 = int.from_bytes(ALT4_BLK_HEADER, "little")
+
+
+def _direct_blocks(blk_type, size, locs):
+    """Block table of uncompressed blocks at `locs`"""
+
+    blocks = np.zeros(len(locs), dtype=BLOCK_DTYPE)
+    blocks["type"] = blk_type
+    blocks["size"] = size
+    blocks["in_loc"] = locs
+    blocks["in_nib"] = -1
+    blocks["out_loc"] = locs
+    blocks["crc_loc"] = blocks["out_loc"] + size - CRC_SIZE
+    return blocks
+
+
+def find_blocks(bs, loc):
+    """Block table of the uncompressed blocks from `loc` on
+
+    The walk stops after the last block (ALT3), in front of a block which
+    enables the decompression, or at the end of `bs`. The headers of many
+    default blocks are checked at once, so an uncompressed image is walked
+    to the end quickly.
+    """
+
+    bs = np.ascontiguousarray(bs, dtype=np.uint8)
+    n = bs.shape[0]
+    if n < 4:
+        return np.zeros(0, dtype=BLOCK_DTYPE)
+
+    hdrs = np.ndarray(shape=(n - 3,), dtype="<u4", buffer=bs, strides=(1,))
+    special = {
+        _HDR_ALT: (BLK_TYPE_ALT, BLK_SIZE_ALT),
+        _HDR_ALT2: (BLK_TYPE_ALT2, BLK_SIZE_ALT2),
+        _HDR_ALT3: (BLK_TYPE_ALT3, BLK_SIZE_ALT3),
+        _HDR_ALT4: (BLK_TYPE_ALT4, BLK_SIZE_ALT),
+    }
+    special_hdrs = np.array(list(special), dtype=np.uint32)
+
+    runs = []
+    while loc < n - 3:
+        locs = np.arange(loc, min(loc + BLK_BATCH * BLK_SIZE, n - 3), BLK_SIZE)
+        hdr = hdrs[locs]
+        stop = ((hdr & 0xFF) == DECOMP_ENABLE) | np.isin(hdr, special_hdrs)
+        nr_blks = int(np.argmax(stop)) if stop.any() else locs.shape[0]
+        runs.append(_direct_blocks(BLK_TYPE_DEFAULT, BLK_SIZE, locs[:nr_blks]))
+
+        if nr_blks == locs.shape[0]:
+            loc = int(locs[-1]) + BLK_SIZE
+            continue
+
+        loc, hdr = int(locs[nr_blks]), int(hdr[nr_blks])
+        if hdr & 0xFF == DECOMP_ENABLE:
+            break
+
+        blk_type, size = special[hdr]
+        runs.append(_direct_blocks(blk_type, size, [loc]))
+        loc += size
+        if blk_type == BLK_TYPE_ALT3:
+            break
+
+    blocks = np.concatenate(runs) if runs else np.zeros(0, dtype=BLOCK_DTYPE)
+
+    # the last block may be cut off
+    return blocks[blocks["in_loc"] + blocks["size"] <= n]
+
+
+def find_decomp_enable(bs, loc):
+    """Byte address of the block which enables the decompression, or -1
+
+    The blocks are walked (uncompressed) from `loc` on, see `find_blocks`.
+    """
+
+    blocks = find_blocks(bs, loc)
+    if blocks.shape[0]:
+        if blocks[-1]["type"] == BLK_TYPE_ALT3:
+            return -1
+        loc = int(blocks[-1]["in_loc"] + blocks[-1]["size"])
+
+    if loc < bs.shape[0] - 3 and bs[loc] == DECOMP_ENABLE:
+        return loc
+    return -1
+
+
+def expand_nibbles(bs):
+    """Nibbles of a byte array (low nibble of a byte first)"""
+
+    nibs = np.empty(2 * bs.shape[0], dtype=np.uint8)
+    nibs[0::2] = bs & 0xF
+    nibs[1::2] = bs >> 4
+    return nibs
+
+
+def _fix_chain(flags, step, real, guess, end, offs=0):
+    """Fixes a guessed chain of groups with the real one
+
+    Both chains are followed (and the flags fixed) until they meet, or until
+    the guessed chain reaches `end`.
+
+    Args:
+        flags: control nibble flags (writable buffer), indexed by `nib - offs`
+        step: function returning the group length at a nibble address
+        real, guess: start of the real and the guessed chain
+
+    Returns:
+        position of the real chain, and if the chains met
+    """
+
+    while guess != real:
+        if guess < real:
+            flags[guess - offs] = 0
+            guess += step(guess)
+            if guess >= end:
+                while real < end:
+                    flags[real - offs] = 1
+                    real += step(real)
+                return real, False
+        else:
+            flags[real - offs] = 1
+            real += step(real)
+
+    return real, True
+
+
+def find_group_starts(nibs, is_start):
+    """Flags the control nibbles of a chain of groups starting at nibble 0
+
+    Every group only tells where the next one starts, so the stream is split
+    into segments and a chain of groups is followed from the start of every
+    segment at once. The chains quickly synchronize, the guessed chain of a
+    segment is then corrected by following the real chain (coming from the
+    previous segment) until they meet.
+
+    Args:
+        nibs: compressed stream (see `expand_nibbles`)
+        is_start: output, zeroed bool array, one element longer than `nibs`
+            (the last element is overwritten)
+
+    Returns:
+        start of the first group past the end of `nibs`
+    """
+
+    n = nibs.shape[0]
+
+    # group length = 1 + popcount of the control nibble
+    step = np.empty(n + 1, dtype=np.uint8)
+    pop2 = (nibs & 5) + ((nibs >> 1) & 5)
+    step[:n] = 1 + (pop2 & 3) + (pop2 >> 2)
+    step[n] = 1
+
+    seg_begin = np.arange(0, n, GROUP_SEG_SIZE)
+    seg_end = np.minimum(seg_begin + GROUP_SEG_SIZE, n)
+
+    pos = seg_begin
+    for i in range(GROUP_SEG_SIZE):
+        is_start[pos] = True
+        if i % 64 == 0 and np.array_equal(pos, seg_end):
+            break
+        pos = np.minimum(pos + step[pos], seg_end)
+
+    starts = np.flatnonzero(is_start[:n])
+    last = starts[np.searchsorted(starts, seg_end) - 1]
+    seg_exit = last + step[last]
+
+    # memoryview and bytes, the (scalar) fixups are much faster this way
+    flags = memoryview(is_start.view(np.uint8))
+    step = step.tobytes().__getitem__
+
+    real = 0
+    segs = zip(seg_begin.tolist(), seg_end.tolist(), seg_exit.tolist())
+    for guess, end, exit in segs:
+        real, met = _fix_chain(flags, step, real, guess, end)
+        if met:
+            real = exit
+
+    return real
+
+
+def find_window_starts(bs, is_start, begin, w_begin, w_end):
+    """`find_group_starts` for nibbles [w_begin, w_end) of `bs`
+
+    Args:
+        is_start: control nibble flags, starting at nibble `begin`
+
+    Returns:
+        start of the first group past `w_end`
+    """
+
+    nibs = expand_nibbles(bs[w_begin // 2 : (w_end + 1) // 2])[w_begin & 1 :]
+    flags = is_start[w_begin - begin : w_end - begin + 1]
+    return w_begin + find_group_starts(nibs[: w_end - w_begin], flags)
+
+
+def group_words(bs, nib_addrs):
+    """The 5 nibbles starting at every nibble address, as 20-bit words"""
+
+    first = int(nib_addrs[0]) >> 1
+    padded = np.zeros(int(nib_addrs[-1]) // 2 - first + 4, dtype=np.uint8)
+    src = bs[first : first + padded.shape[0]]
+    padded[: src.shape[0]] = src
+
+    # unaligned 32-bit reads, starting at every byte
+    words32 = np.ndarray(
+        shape=(padded.shape[0] - 3,), dtype="<u4", buffer=padded, strides=(1,)
+    )
+
+    words = np.take(words32, (nib_addrs >> 1) - first)
+    np.right_shift(words, ((nib_addrs & 1) << 2).astype(np.uint32), out=words)
+    np.bitwise_and(words, 0xFFFFF, out=words)
+    return words
+
+
+def decode_groups(bs, starts):
+    """Decodes the groups starting at (sorted) nibble addresses `starts`
+
+    Returns:
+        decoded bytes, 2 per group
+    """
+
+    if starts.shape[0] == 0:
+        return np.zeros(0, dtype=np.uint8)
+
+    return np.take(GROUP_LUT, group_words(bs, starts)).view(np.uint8)
+
+
+def peek_headers(bs, locs):
+    """First 4 decoded bytes of the stream at byte addresses `locs`, as uint32
+
+    Any pending nibble is ignored, same as the `_peek_decomp` in the notebook.
+    """
+
+    nibs = 2 * np.asarray(locs, dtype=np.int64)
+    words = group_words(bs, nibs)
+    nxt = nibs + GROUP_LEN[words & 0xF]
+
+    hdr = np.take(GROUP_LUT, words).astype(np.uint32)
+    hdr |= np.take(GROUP_LUT, group_words(bs, nxt)).astype(np.uint32) << 16
+    return hdr
+
+
+def walk_groups(bs, in_nibs, nr_groups):
+    """Starts of the groups of blocks, following the chain of every block
+
+    Needs no control nibble flags, but is only fast enough for a few blocks.
+    """
+
+    b = memoryview(np.ascontiguousarray(bs, dtype=np.uint8))
+    grp_len = _GROUP_LEN_LST
+
+    starts = []
+    for nib, nr in zip(in_nibs, nr_groups):
+        for _ in range(nr):
+            starts.append(nib)
+            nib += grp_len[(b[nib >> 1] >> ((nib & 1) << 2)) & 0xF]
+
+    return np.array(starts, dtype=np.int64)
+
+
+def decode_blocks(bs, is_start, begin, blocks, out):
+    """Decodes compressed blocks
+
+    Args:
+        bs: compressed stream (np.uint8)
+        is_start: control nibble flags, starting at nibble `begin`; if None,
+            the groups are found with `walk_groups`
+        blocks: block table (BLOCK_DTYPE) of compressed blocks
+        out: output buffer
+    """
+
+    is_alt4 = blocks["type"] == BLK_TYPE_ALT4
+    nr_groups = (blocks["size"] - ALT4_HDR_SIZE * is_alt4) // 2
+    grp_out = blocks["out_loc"] + ALT4_HDR_SIZE * is_alt4
+    grp_first = np.cumsum(nr_groups) - nr_groups
+    in_nib = blocks["in_nib"]
+
+    if is_start is None:
+        starts = walk_groups(bs, in_nib.tolist(), nr_groups.tolist())
+        _copy_groups(decode_groups(bs, starts), grp_out, grp_first, nr_groups, out)
+        return
+
+    lo = int(in_nib[0])
+    hi = min(int(in_nib[-1]) + 5 * int(nr_groups[-1]), begin + is_start.shape[0] - 1)
+    starts = np.flatnonzero(is_start[lo - begin : hi - begin]) + lo
+
+    # usually the blocks follow each other, their groups are a single run
+    first = np.searchsorted(starts, in_nib)
+    if np.array_equal(first - first[0], grp_first):
+        starts = starts[first[0] : first[0] + int(nr_groups.sum())]
+    else:
+        grp_idx = np.repeat(first - grp_first, nr_groups)
+        starts = starts[grp_idx + np.arange(grp_idx.shape[0])]
+
+    _copy_groups(decode_groups(bs, starts), grp_out, grp_first, nr_groups, out)
+
+
+def _copy_groups(dec, grp_out, grp_first, nr_groups, out):
+    """Copies the decoded groups of every block to the output"""
+
+    for out_loc, dec_loc, size in zip(
+        grp_out.tolist(), (2 * grp_first).tolist(), (2 * nr_groups).tolist()
+    ):
+        out[out_loc : out_loc + size] = dec[dec_loc : dec_loc + size]
+
+
+def _shared_zeros(size, dtype=np.uint8):
+    """Zeroed array in shared memory, visible to the forked pool workers"""
+
+    dtype = np.dtype(dtype)
+    buf = mmap.mmap(-1, max(size * dtype.itemsize, 1))
+    return np.frombuffer(buf, dtype=dtype, count=size)
+
+
+# set in the parent process before the pool is created, inherited by the workers
+_pool_state = None
+
+
+def _pool_map(fn, tasks, jobs, state):
+    global _pool_state  # pylint: disable=global-statement
+
+    _pool_state = state
+    try:
+        ctx = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as executor:
+            return list(executor.map(fn, tasks))
+    finally:
+        _pool_state = None
+
+
+def _pool_find_starts(task):
+    bs, is_start, begin = _pool_state
+    return find_window_starts(bs, is_start, begin, *task)
+
+
+def _pool_decode(task):
+    bs, is_start, begin, blocks, out = _pool_state
+    first, end = task
+    decode_blocks(bs, is_start, begin, blocks[first:end], out)
+
+
+class _GroupChain:
+    """Control nibble flags of the compressed stream, from nibble `begin` on
+
+    The flags are found one window at a time, every window starts with a
+    guess which is fixed when the window is joined with the previous one.
+    """
+
+    def __init__(self, bs, b, begin, jobs=1):
+        self._bs = bs
+        self._b = b
+        self.begin = begin
+        self.end = 2 * bs.shape[0]
+
+        size = self.end - begin + 1
+        self.is_start = _shared_zeros(size, bool) if jobs > 1 else np.zeros(size, bool)
+        self._flags = memoryview(self.is_start.view(np.uint8))
+
+        # the flags are final up to `valid`, `_exit` is the first group past it
+        self.valid = begin
+        self._exit = begin
+
+        # windows found in advance, w_begin -> (w_end, exit)
+        self._windows = {}
+
+        # group starts in [_starts_begin, _starts_end), kept by starts_from
+        self._starts = np.zeros(0, dtype=np.int64)
+        self._starts_begin = self._starts_end = begin
+
+    def step(self, nib):
+        """Group length at nibble `nib`"""
+        return _GROUP_LEN_LST[(self._b[nib >> 1] >> ((nib & 1) << 2)) & 0xF]
+
+    def find_windows(self, end, jobs):
+        """Finds the group starts up to `end` in advance, in a process pool"""
+
+        size = max(min(GROUP_WINDOW, -(-(end - self.valid) // (4 * jobs))), 1 << 16)
+        tasks = [
+            (w_begin, min(w_begin + size, self.end))
+            for w_begin in range(self.valid, min(end, self.end), size)
+        ]
+
+        state = (self._bs, self.is_start, self.begin)
+        for task, exit in zip(tasks, _pool_map(_pool_find_starts, tasks, jobs, state)):
+            self._windows[task[0]] = (task[1], exit)
+
+    def ensure(self, nib):
+        """Makes sure the flags are final up to `nib`"""
+
+        while self.valid < min(nib, self.end):
+            w_begin = self.valid
+            if w_begin in self._windows:
+                w_end, exit = self._windows.pop(w_begin)
+            else:
+                w_end = min(w_begin + GROUP_WINDOW, self.end)
+                exit = find_window_starts(
+                    self._bs, self.is_start, self.begin, w_begin, w_end
+                )
+
+            real, met = _fix_chain(
+                self._flags, self.step, self._exit, w_begin, w_end, self.begin
+            )
+            self._exit = exit if met else real
+            self.valid = w_end
+
+    def starts_from(self, nib, nr_groups):
+        """Starts of (up to) `nr_groups` groups, starting with the group at `nib`"""
+
+        if not self._starts_begin <= nib <= self._starts_end:
+            self._starts = np.zeros(0, dtype=np.int64)
+            self._starts_begin = self._starts_end = nib
+
+        idx = np.searchsorted(self._starts, nib)
+        while self._starts.shape[0] - idx < nr_groups and self._starts_end < self.end:
+            # a group is 5 nibbles at most, but usually much shorter
+            missing = nr_groups - (self._starts.shape[0] - idx)
+            end = min(self._starts_end + max(3 * missing, 1 << 20), self.end)
+            self.ensure(end)
+
+            flags = self.is_start[self._starts_end - self.begin : end - self.begin]
+            found = np.flatnonzero(flags) + self._starts_end
+            self._starts = np.concatenate([self._starts[idx:], found])
+            self._starts_begin, self._starts_end = nib, end
+            idx = 0
+
+        return self._starts[idx : idx + nr_groups]
+
+    def restart(self, old, new):
+        """Replaces the chain from `old` on with a new chain starting at `new`
+
+        The new chain is followed until it meets the old one.
+        """
+
+        self.ensure(new + GROUP_SEG_SIZE)
+        real, met = _fix_chain(self._flags, self.step, new, old, self.valid, self.begin)
+        if not met:
+            self._exit = real
+
+        # the starts found by starts_from are only kept in front of the change
+        changed = min(old, new)
+        if self._starts_end > changed:
+            keep = np.searchsorted(self._starts, changed)
+            self._starts = self._starts[:keep]
+            self._starts_end = max(changed, self._starts_begin)
+
+
+class JicDecompressor:
+    def __init__(self, jic, sel=0, jobs=1):
+        """
+        Args:
+            jic: JicBitstream with the compressed image
+            sel: index of the image (a factory .jic can contain two)
+            jobs: number of processes used to find the group starts and to
+                decode the blocks
+        """
+
+        self._jic = jic
+        self._bs = np.asarray(jic.jic_uint8)
+        self.sel = sel
+        self.jobs = jobs
+
+        # raw bytes and the "jjjj" locations, only needed to scan the stream
+        self._b = None
+        self._jjjj_locs = None
+
+        # set by the scan, or from a block index
+        self._prefix_size = None
+        self._header_loc = None
+        self._blocks = None
+        self._chain = None
+
+    @property
+    def jjjj_locs(self):
+        if self._jjjj_locs is None:
+            self._jjjj_locs = self._jic.find_jjjj_seqs()
+        return self._jjjj_locs
+
+    @property
+    def prefix_size(self):
+        if self._prefix_size is None:
+            self._prefix_size = max(int(self.jjjj_locs[0]) - PREFIX_TRIM, 0)
+        return self._prefix_size
+
+    @property
+    def header_loc(self):
+        if self._header_loc is None:
+            self._header_loc = int(self.jjjj_locs[self.sel]) + MAGIC_SIZE
+        return self._header_loc
+
+    @property
+    def blocks(self):
+        """Block table (BLOCK_DTYPE), the stream is scanned on first access"""
+
+        if self._blocks is None:
+            self._blocks = self._scan()
+        return self._blocks
+
+    @property
+    def out_size(self):
+        last = self.blocks[-1]
+        return int(last["out_loc"] + last["size"])
+
+    def save_index(self, filename, key=()):
+        """Saves the block table, so that the stream does not need a scan again
+
+        Args:
+            key: integers identifying the .jic (e.g. its size and mtime),
+                checked by `load_index`
+        """
+
+        # write to a temp file first, another process may be reading the index
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, "wb") as f:
+            np.savez(
+                f,
+                blocks=self.blocks,
+                info=np.array([INDEX_VERSION, self.prefix_size, self.header_loc]),
+                key=np.array(key, dtype=np.int64),
+            )
+        os.replace(tmp_filename, filename)
+
+    def load_index(self, filename, key=()):
+        """Loads a block table saved by `save_index`
+
+        Returns:
+            True if the index was loaded, False if it is missing or stale
+        """
+
+        try:
+            with np.load(filename) as index:
+                info, blocks = index["info"].tolist(), index["blocks"]
+                stale = not np.array_equal(index["key"], np.array(key, dtype=np.int64))
+        except (OSError, ValueError, KeyError):
+            return False
+
+        if stale or info[0] != INDEX_VERSION or blocks.dtype != BLOCK_DTYPE:
+            return False
+
+        _, self._prefix_size, self._header_loc = info
+        self._blocks = blocks
+        return True
+
+    def decompress(self):
+        """Returns the decompressed image"""
+
+        # the control nibble flags are needed, a loaded index is not enough
+        if self._chain is None:
+            self._blocks = self._scan()
+
+        blocks = self.blocks
+        if self.jobs > 1:
+            out = _shared_zeros(self.out_size)
+        else:
+            out = np.zeros(self.out_size, dtype=np.uint8)
+
+        self._copy_direct(out)
+
+        comp = blocks[blocks["in_nib"] >= 0]
+        tasks = [
+            (first, first + DECODE_BLOCKS)
+            for first in range(0, comp.shape[0], DECODE_BLOCKS)
+        ]
+        chain = self._chain
+
+        if self.jobs > 1:
+            state = (self._bs, chain.is_start, chain.begin, comp, out)
+            _pool_map(_pool_decode, tasks, self.jobs, state)
+        else:
+            for first, end in tasks:
+                blks = comp[first:end]
+                decode_blocks(self._bs, chain.is_start, chain.begin, blks, out)
+
+        return out
+
+    def read(self, locs):
+        """Decompressed bytes at byte addresses `locs`
+
+        Only the blocks containing `locs` are decoded, the image is not
+        decompressed as a whole.
+        """
+
+        locs = np.asarray(locs, dtype=np.int64)
+        if locs.size and (locs.min() < 0 or locs.max() >= self.out_size):
+            raise IndexError(f"address out of range (image size {self.out_size})")
+
+        vals = np.empty(locs.shape, dtype=np.uint8)
+        blocks = self.blocks
+
+        # prefix and header, stored uncompressed
+        in_prefix = locs < self.prefix_size
+        vals[in_prefix] = self._bs[locs[in_prefix]]
+        in_header = ~in_prefix & (locs < self.prefix_size + HEADER_SIZE)
+        hdr_locs = locs[in_header] - self.prefix_size + self.header_loc
+        vals[in_header] = self._bs[hdr_locs]
+
+        in_blocks = locs >= self.prefix_size + HEADER_SIZE
+        blk_idx = np.searchsorted(blocks["out_loc"], locs[in_blocks], side="right") - 1
+
+        # the needed blocks are decoded next to each other into a small buffer
+        need, pos = np.unique(blk_idx, return_inverse=True)
+        sub = blocks[need]
+        sub["out_loc"] = np.cumsum(sub["size"]) - sub["size"]
+        buf = np.zeros(int(sub["size"].sum()), dtype=np.uint8)
+
+        self._copy_direct_blocks(sub, buf)
+        comp = sub[sub["in_nib"] >= 0]
+        if comp.shape[0] and self._chain is None:
+            # blocks from an index, only the needed ones are walked
+            decode_blocks(self._bs, None, 0, comp, buf)
+        elif comp.shape[0]:
+            chain = self._chain
+            decode_blocks(self._bs, chain.is_start, chain.begin, comp, buf)
+
+        buf_locs = sub["out_loc"][pos] + locs[in_blocks] - blocks["out_loc"][blk_idx]
+        vals[in_blocks] = buf[buf_locs]
+        return vals
+
+    def _copy_direct(self, out):
+        """Copies everything which is stored uncompressed"""
+
+        bs = self._bs
+
+        prefix_size = self.prefix_size
+        out[:prefix_size] = bs[:prefix_size]
+        out[prefix_size : prefix_size + HEADER_SIZE] = bs[
+            self.header_loc : self.header_loc + HEADER_SIZE
+        ]
+
+        self._copy_direct_blocks(self.blocks, out)
+
+    def _copy_direct_blocks(self, blocks, out):
+        """Copies the uncompressed blocks (and ALT4 headers) of `blocks`"""
+
+        bs = self._bs
+
+        direct = blocks[(blocks["in_nib"] < 0) | (blocks["type"] == BLK_TYPE_ALT4)]
+        for blk in direct:
+            size = blk["size"] if blk["in_nib"] < 0 else ALT4_HDR_SIZE
+            out_loc, in_loc = blk["out_loc"], blk["in_loc"]
+            out[out_loc : out_loc + size] = bs[in_loc : in_loc + size]
+
+    def _new_chain(self, nib):
+        chain = _GroupChain(self._bs, self._b, nib, self.jobs)
+
+        if self.jobs > 1:
+            # the image ends before the next "jjjj" (if any)
+            next_jjjj = self.jjjj_locs[self.jjjj_locs > nib // 2]
+            end = 2 * int(next_jjjj[0]) if next_jjjj.shape[0] else chain.end
+            chain.find_windows(end, self.jobs)
+
+        return chain
+
+    def _scan_default_blocks(self, nib, out_loc):
+        """Finds a run of default blocks, the first one starts at nibble `nib`
+
+        Returns:
+            block table of the run (can be empty), and the end of the run
+        """
+
+        nr_groups = BLK_SIZE // 2
+        starts = self._chain.starts_from(nib, BLK_BATCH * nr_groups + 1)
+        nr_blks = min((starts.shape[0] - 1) // nr_groups, BLK_BATCH)
+
+        in_nib = starts[: nr_blks * nr_groups + 1 : nr_groups]
+        in_loc = (in_nib + 1) // 2
+        if nr_blks == 0 or in_loc[-1] + 4 > self._bs.shape[0]:
+            return np.zeros(0, dtype=BLOCK_DTYPE), nib
+
+        hdr_direct = np.ndarray(
+            shape=(self._bs.shape[0] - 3,), dtype="<u4", buffer=self._b, strides=(1,)
+        )[in_loc[:-1]]
+        hdr = peek_headers(self._bs, in_loc[:-1])
+        special = (
+            (hdr == _HDR_ALT)
+            | (hdr == _HDR_ALT2)
+            | (hdr_direct == _HDR_ALT3)
+            | (hdr_direct == _HDR_ALT4)
+        )
+        if special.any():
+            nr_blks = int(np.argmax(special))
+
+        blocks = np.zeros(nr_blks, dtype=BLOCK_DTYPE)
+        blocks["type"] = BLK_TYPE_DEFAULT
+        blocks["size"] = BLK_SIZE
+        blocks["in_loc"] = in_loc[:nr_blks]
+        blocks["in_nib"] = in_nib[:nr_blks]
+        blocks["out_loc"] = out_loc + BLK_SIZE * np.arange(nr_blks)
+        blocks["crc_loc"] = blocks["out_loc"] + BLK_SIZE - CRC_SIZE
+
+        return blocks, int(in_nib[nr_blks])
+
+    def _scan(self):
+        if self._b is None:
+            self._b = self._bs.tobytes()
+
+        b = self._b
+        self._chain = None
+        blocks = []
+
+        loc = self.header_loc + HEADER_SIZE
+        out_loc = self.prefix_size + HEADER_SIZE
+
+        # nibble address of the pending (high) nibble, if any
+        pending = None
+        decomp_enable = False
+
+        # end of the last compressed block
+        chain_end = None
+
+        try:
+            while True:
+                # fast path, many default blocks at once
+                if decomp_enable and chain_end == 2 * loc - (pending is not None):
+                    run, chain_end = self._scan_default_blocks(chain_end, out_loc)
+                    if run.shape[0]:
+                        blocks.append(run)
+                        out_loc += BLK_SIZE * run.shape[0]
+                        loc = (chain_end + 1) // 2
+                        pending = chain_end if chain_end & 1 else None
+
+                        if run.shape[0] == BLK_BATCH:
+                            continue
+
+                hdr_direct = b[loc : loc + 4]
+                if hdr_direct[0] == DECOMP_ENABLE:
+                    decomp_enable = True
+
+                if decomp_enable:
+                    hdr = int(peek_headers(self._bs, [loc])[0]).to_bytes(4, "little")
+                else:
+                    hdr = hdr_direct
+
+                in_loc = loc
+                if hdr == ALT_BLK_HEADER:
+                    blk_type, size = BLK_TYPE_ALT, BLK_SIZE_ALT
+                elif hdr == ALT2_BLK_HEADER:
+                    blk_type, size = BLK_TYPE_ALT2, BLK_SIZE_ALT2
+                elif hdr_direct == ALT3_BLK_HEADER:
+                    blk_type, size = BLK_TYPE_ALT3, BLK_SIZE_ALT3
+                elif hdr_direct == ALT4_BLK_HEADER:
+                    blk_type, size = BLK_TYPE_ALT4, BLK_SIZE_ALT
+                else:
+                    blk_type, size = BLK_TYPE_DEFAULT, BLK_SIZE
+
+                if blk_type == BLK_TYPE_ALT4:
+                    loc += ALT4_HDR_SIZE
+                    pending = None
+                    in_nib = 2 * loc
+                    nr_groups = (size - ALT4_HDR_SIZE) // 2
+                elif decomp_enable:
+                    if pending is None:
+                        in_nib = 2 * loc
+                    elif pending == 2 * loc - 1:
+                        in_nib = pending
+                    else:
+                        # the half-used byte of a block is always followed by
+                        # the next block, anything else is a corrupt stream
+                        raise ValueError(
+                            f"block {len(blocks)} at offset {loc:#x}: pending "
+                            f"nibble {pending} is not in front of the block"
+                        )
+                    nr_groups = size // 2
+                else:
+                    in_nib = -1
+
+                if in_nib < 0:
+                    if loc + size > len(b):
+                        raise IndexError
+                    loc += size
+                else:
+                    if self._chain is None:
+                        self._chain = self._new_chain(in_nib)
+                    elif chain_end != in_nib:
+                        self._chain.restart(chain_end, in_nib)
+
+                    starts = self._chain.starts_from(in_nib, nr_groups)
+                    if starts.shape[0] < nr_groups:
+                        raise IndexError
+                    chain_end = int(starts[-1]) + self._chain.step(int(starts[-1]))
+
+                    if (chain_end + 1) // 2 > len(b):
+                        raise IndexError
+                    loc = (chain_end + 1) // 2
+                    pending = chain_end if chain_end & 1 else None
+
+                crc_loc = out_loc + size - CRC_SIZE
+                blk = (blk_type, size, in_loc, in_nib, out_loc, crc_loc)
+                blocks.append(np.array([blk], dtype=BLOCK_DTYPE))
+                out_loc += size
+
+                if blk_type == BLK_TYPE_ALT3:
+                    break
+        except IndexError:
+            raise ValueError(
+                f"compressed stream ends unexpectedly in block {len(blocks)}"
+            ) from None
+
+        return np.concatenate(blocks)
+
+
+def decompress_images(jic, jobs=1):
+    """Decompresses all the images in `jic` (a factory .jic contains two)"""
+
+    return [
+        JicDecompressor(jic, sel, jobs).decompress()
+        for sel in range(len(jic.find_jjjj_seqs()))
+    ]
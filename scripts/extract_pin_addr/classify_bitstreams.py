@@ -0,0 +1,148 @@
+#! /usr/bin/env python3
+
+"""Classify a list of pins in many bitstreams
+
+Accepts .jic files (compressed ones too with --decompress, see
+`JicBitstream`) and results .zip files (glob patterns are expanded) and
+writes one row per (file, pin) as CSV or JSONL. The files are spread across
+a process pool; the classifier tables are prepared before the workers are
+forked, so they are shared copy-on-write.
+
+Example:
+    ./classify_bitstreams.py "../../bitstreams/**/*.jic" \
+        --pins ../../resources/pin_list_5SGSMD5K1F40C1_8AD.txt -o out.csv
+"""
+
+import argparse
+import csv
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from IOclassifier import IOCLASSIFIER_TABLE_DTYPE, IOSTD_REL_TO_PU, IOclassifier
+from JicBitstream import JicBitstream, JicBitstreamZip
+
+FIELDS = ["filename"] + list(IOCLASSIFIER_TABLE_DTYPE.names)
+
+# set in the parent process before the pool is created, inherited by the workers
+_iocls = None
+_pin_lst = None
+_decompress = False
+
+
+def _open_bitstream(filename):
+    if filename.endswith(".zip"):
+        return JicBitstreamZip(filename, cache=False)
+    return JicBitstream(filename, decompress=_decompress)
+
+
+def _classify_file(filename):
+    try:
+        table = _iocls.classify_table(_open_bitstream(filename), _pin_lst)
+    except Exception as e:  # pylint: disable=broad-except
+        return filename, None, f"{type(e).__name__}: {e}"
+
+    rows = [[filename] + [el.item() for el in row] for row in table]
+    return filename, rows, None
+
+
+def _write_csv(f_out):
+    writer = csv.writer(f_out)
+    writer.writerow(FIELDS)
+
+    def write(rows):
+        writer.writerows(rows)
+
+    return write
+
+
+def _write_jsonl(f_out):
+    def write(rows):
+        for row in rows:
+            obj = dict(zip(FIELDS, row))
+            obj["term"] = obj["term"] or None
+            f_out.write(json.dumps(obj) + "\n")
+
+    return write
+
+
+def expand_patterns(patterns):
+    filenames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches:
+            logging.warning("no files match %s", pattern)
+        filenames.extend(matches)
+
+    # remove duplicates, keep the order
+    return list(dict.fromkeys(filenames))
+
+
+def main():
+    global _iocls, _pin_lst, _decompress  # pylint: disable=global-statement
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("patterns", nargs="+", help=".jic/.zip files or globs")
+    parser.add_argument("--pins", required=True, help="pin list, one pin per line")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=["csv", "jsonl"],
+        help="output format (default: from the output extension, or csv)",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count(), help="number of workers"
+    )
+    parser.add_argument(
+        "--decompress",
+        action="store_true",
+        help="decompress compressed .jic files (e.g. factory images) first",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    filenames = expand_patterns(args.patterns)
+    _decompress = args.decompress
+    _pin_lst = [line.strip() for line in open(args.pins, "r") if line.strip()]
+
+    # prepare all the tables in the parent, the workers get them for free
+    _iocls = IOclassifier()
+    _iocls.get_feat_addrs(_pin_lst)
+    _iocls.get_iostd_batch(np.zeros((1, len(IOSTD_REL_TO_PU)), dtype=int))
+    _iocls.pins_info  # pylint: disable=pointless-statement
+
+    fmt = args.format
+    if fmt is None:
+        fmt = "jsonl" if args.output and args.output.endswith(".jsonl") else "csv"
+
+    f_out = open(args.output, "w", newline="") if args.output else sys.stdout
+    write = _write_jsonl(f_out) if fmt == "jsonl" else _write_csv(f_out)
+
+    nr_failed = 0
+    ctx = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=args.jobs, mp_context=ctx) as executor:
+        for filename, rows, err in executor.map(_classify_file, filenames):
+            if err is not None:
+                logging.error("%s: %s", filename, err)
+                nr_failed += 1
+                continue
+            write(rows)
+            f_out.flush()
+
+    if f_out is not sys.stdout:
+        f_out.close()
+
+    logging.info("classified %d files, %d failed", len(filenames), nr_failed)
+    return 1 if nr_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1503,7 +1503,7 @@ DRV_STRENGTH_SSTL_CLASS1_ADDR = {
 }
 
 
-# first bit, the checksum is 16 bit long
+# first bit, the checksum is 16 bit long (see JicCrc.crc_addr_starts)
 CHKSUM_ADDR_START = array(
     [
         813696,
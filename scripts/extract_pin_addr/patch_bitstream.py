@@ -0,0 +1,315 @@
+#! /usr/bin/env python3
+
+"""Apply a pin configuration to a .jic without recompiling it in Quartus
+
+The base .jic is copied to the output and the feature bits of the pins (see
+`IOSTD_REL_TO_PU`) are set directly in the memory-mapped output, the block
+CRCs are updated incrementally (see `JicBitstream.set_els`).
+
+The spec is a JSON object, one entry per pin, either the features to set
+(by name, see FEATURE_NAMES, or by the address relative to the PU bit) or a
+bitstream (.jic/.zip) generated by Quartus to copy the features from (the
+ones which differ from the base):
+
+    {
+        "R32": {"pu": 1, "-512": 0},
+        "P32": "../../results/out/P32_sstl15_default.zip",
+        "N32": {"io_std": "2V5", "cur_strength": "8mA"},
+        "M32": {"io_std": "Scls1", "term": "no term"}
+    }
+
+The settings are mapped to the features with the known tables:
+
+    io_std        as decoded by IOclassifier (2V5, S, Scls1, Scls2), the
+                  bits are the decoder input closest to the base which agrees
+                  with the other features of the pin
+    term          as decoded by IOclassifier (TERM_BITS), SSTL only
+    cur_strength  knowledge.DRV_STRENGTH_2V5_VAL_* (CUR_STRENGTH_2V5), 2V5 only
+
+The features given by name or address override the settings; the result is
+decoded again and rejected if the settings don't hold.
+
+The feature windows of the neighbouring pins overlap (e.g. +864 of R32 is a
+feature of P32 too), a bit which two pins set to different values is
+rejected.
+
+With --check, the base is patched in memory with the features of every
+given Quartus bitstream (the pin is taken from the filename, as generated by
+`gen_bitstreams`) and the result is compared with the Quartus bitstream.
+
+Example:
+    ./patch_bitstream.py base_project.jic spec.json -o patched.jic
+    ./patch_bitstream.py ../../results/out/R32_2V5_on_chip_term.zip \\
+        --check "../../results/out/R32_*.zip"
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from classify_bitstreams import expand_patterns
+from IOclassifier import IOSTD_REL_TO_PU, IOclassifier
+from JicBitstream import JicBitstream, JicBitstreamZip
+from knowledge import (
+    DRV_STRENGTH_2V5_ADDR,
+    DRV_STRENGTH_2V5_VAL_4MA,
+    DRV_STRENGTH_2V5_VAL_8MA,
+    DRV_STRENGTH_2V5_VAL_12MA,
+    DRV_STRENGTH_2V5_VAL_16MA,
+    PU_ADDR,
+)
+
+FEATURE_NAMES = {
+    "pu": IOclassifier.IDX_PU,
+    "input_act_b": IOclassifier.IDX_INPUT_ACT_B,
+    "input_act_b_diff": IOclassifier.IDX_INPUT_ACT_B_DIFF,
+    "io_std_rx_diff": IOclassifier.IDX_IO_STD_RX_DIFF,
+    "io_std_tx_diff": IOclassifier.IDX_IO_STD_TX_DIFF,
+}
+
+# bits at IOclassifier.IDX_SSTL_TERM, "no term" as seen with the termination off
+TERM_BITS = {
+    "SSTL, term": IOclassifier.SSTL_TERM_DEF,
+    "SSTL cl1/2, term": IOclassifier.SSTL_TERM_CL1_2,
+    "no term": np.array([0, 0, 0]),
+}
+
+# the drive strength bits are at the same place relative to the PU bit for all
+# the pins in knowledge.py (and assumed to be for the other pins)
+_drv_strength_rel = {
+    tuple(int(addr) for addr in DRV_STRENGTH_2V5_ADDR[pin] - PU_ADDR[pin])
+    for pin in DRV_STRENGTH_2V5_ADDR
+}
+assert len(_drv_strength_rel) == 1, "drive strength bits differ between the pins"
+IDX_DRV_STRENGTH_2V5 = list(_drv_strength_rel.pop())
+
+CUR_STRENGTH_2V5 = {
+    "4mA": DRV_STRENGTH_2V5_VAL_4MA,
+    "8mA": DRV_STRENGTH_2V5_VAL_8MA,
+    "12mA": DRV_STRENGTH_2V5_VAL_12MA,
+    "16mA": DRV_STRENGTH_2V5_VAL_16MA,
+}
+
+
+def _open_bitstream(filename, **kwargs):
+    if filename.endswith(".zip"):
+        return JicBitstreamZip(filename)
+    return JicBitstream(filename, **kwargs)
+
+
+def _feature_idx(name):
+    rel_addr = FEATURE_NAMES.get(name)
+    if rel_addr is None:
+        rel_addr = int(name)
+
+    idx = np.flatnonzero(IOSTD_REL_TO_PU == rel_addr)
+    if idx.shape[0] == 0:
+        raise ValueError(f"unknown feature {name}")
+    return int(idx[0])
+
+
+def _setting_bits(name, val):
+    """Positions in IOSTD_REL_TO_PU and the values of the bits for `term` or
+    `cur_strength`"""
+
+    if name == "term":
+        table, rel_addrs = TERM_BITS, IOclassifier.IDX_SSTL_TERM
+    else:
+        table, rel_addrs = CUR_STRENGTH_2V5, IDX_DRV_STRENGTH_2V5
+
+    if val not in table:
+        raise ValueError(f"unsupported {name} {val}, one of: {', '.join(table)}")
+    return np.array([_feature_idx(addr) for addr in rel_addrs]), table[val]
+
+
+def pin_features(iocls, pin, feats, pin_spec):
+    """Applies the settings and the features of `pin_spec` to the features
+
+    Args:
+        feats: current features of the pin, len(IOSTD_REL_TO_PU)
+        pin_spec: dict, see the module docstring
+
+    Returns:
+        the new features, and the mask of the features given by the spec
+    """
+
+    feats = np.array(feats, dtype=int)
+    fixed = np.zeros(feats.shape, dtype=bool)
+
+    for name, val in pin_spec.items():
+        if name in ("term", "cur_strength"):
+            idxs, bits = _setting_bits(name, val)
+            feats[idxs], fixed[idxs] = bits, True
+
+    for name, val in pin_spec.items():
+        if name not in ("io_std", "term", "cur_strength"):
+            idx = _feature_idx(name)
+            feats[idx], fixed[idx] = val, True
+
+    io_std = pin_spec.get("io_std")
+    if io_std is not None:
+        # decoder inputs for io_std which agree with the fixed features
+        idxs, words = iocls.get_iostd_feats(io_std)
+        mask = fixed[idxs]
+        words = words[np.all(words[:, mask] == feats[idxs][mask], axis=1)]
+        if words.shape[0] == 0:
+            raise ValueError(f"{pin}: io_std {io_std} contradicts the other features")
+        dist = np.sum(words != feats[idxs], axis=1)
+        feats[idxs], fixed[idxs] = words[np.argmin(dist)], True
+
+    if not {"io_std", "term", "cur_strength"} & set(pin_spec):
+        return feats, fixed
+
+    # e.g. a raw feature could change the decoded IO standard
+    decoded = str(iocls.get_iostd_batch(feats)[0])
+    if io_std is not None and decoded != io_std:
+        raise ValueError(f"{pin}: the features decode as {decoded}, not {io_std}")
+    if "cur_strength" in pin_spec and decoded != "2V5":
+        raise ValueError(f"{pin}: cur_strength is only known for 2V5, not {decoded}")
+    if "term" in pin_spec and not decoded.startswith("S"):
+        raise ValueError(f"{pin}: term is only known for SSTL, not {decoded}")
+
+    return feats, fixed
+
+
+def spec_to_bits(iocls, spec, base):
+    """Bit addresses and values to set for a spec (see the module docstring)
+
+    Args:
+        base: bitstream the spec is applied to
+
+    Returns:
+        bit addresses (unique) and the values, both 1-D
+
+    Raises:
+        ValueError: two pins set a (shared) bit to different values
+    """
+
+    addrs, vals, pins = [], [], []
+    for pin, pin_spec in spec.items():
+        feat_addrs = iocls.get_feat_addrs([pin])[0]
+        base_feats = base.get_els(feat_addrs)
+
+        if isinstance(pin_spec, str):
+            feats = _open_bitstream(pin_spec).get_els(feat_addrs)
+            given = np.zeros(feats.shape, dtype=bool)
+        else:
+            feats, given = pin_features(iocls, pin, base_feats, pin_spec)
+
+        # only the bits the pin cares about, the rest may belong to a neighbour
+        sel = given | (feats != base_feats)
+        addrs.append(feat_addrs[sel])
+        vals.append(feats[sel].astype(np.uint8))
+        pins.extend([pin] * int(np.sum(sel)))
+
+    if not addrs:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=np.uint8)
+
+    addrs, vals, pins = np.concatenate(addrs), np.concatenate(vals), np.array(pins)
+    order = np.argsort(addrs, kind="stable")
+    addrs, vals, pins = addrs[order], vals[order], pins[order]
+
+    same_addr = addrs[1:] == addrs[:-1]
+    conflicts = np.flatnonzero(same_addr & (vals[1:] != vals[:-1]))
+    if conflicts.shape[0]:
+        idx = conflicts[0]
+        raise ValueError(
+            f"bit {addrs[idx]} is set to {vals[idx]} by {pins[idx]} and to "
+            f"{vals[idx + 1]} by {pins[idx + 1]}"
+        )
+
+    keep = np.concatenate([[True], ~same_addr])
+    return addrs[keep], vals[keep]
+
+
+def write_patched(base_filename, out_filename, addrs, vals):
+    """Copies the base .jic and sets the bits in the (memory-mapped) copy
+
+    Returns:
+        addresses of the flipped bits
+    """
+
+    shutil.copyfile(base_filename, out_filename)
+
+    jic = JicBitstream(out_filename, write=True)
+    if jic.is_compressed:
+        os.remove(out_filename)
+        raise ValueError(f"{base_filename}: compressed images can't be patched")
+
+    flips = jic.set_els(addrs, vals)
+    jic.flush()
+    return flips
+
+
+def pin_from_filename(filename):
+    """Pin of a bitstream generated by `gen_bitstreams`, e.g. R32_sstl15_default.zip"""
+    return os.path.basename(filename).split("_")[0]
+
+
+def check_against(iocls, base_filename, ref_filename):
+    """Patches the base like the Quartus bitstream, compares the two
+
+    Returns:
+        number of the bits which differ, and the indices of the blocks with
+        a wrong CRC in the patched image
+    """
+
+    pin = pin_from_filename(ref_filename)
+    jic = _open_bitstream(base_filename)
+
+    addrs, vals = spec_to_bits(iocls, {pin: ref_filename}, jic)
+    jic.set_els(addrs, vals)
+
+    (diff,) = jic.diff_pos(_open_bitstream(ref_filename))
+    return diff.shape[0], jic.bad_blocks()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("base", help="base .jic (or .zip with --check)")
+    parser.add_argument("spec", nargs="?", help="pin configuration (JSON)")
+    parser.add_argument("-o", "--output", help="patched .jic")
+    parser.add_argument(
+        "--check",
+        nargs="+",
+        metavar="PATTERN",
+        help="compare with bitstreams generated by Quartus (.jic/.zip or globs)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    iocls = IOclassifier()
+
+    if args.check:
+        nr_failed = 0
+        for ref_filename in expand_patterns(args.check):
+            nr_diff, bad_blocks = check_against(iocls, args.base, ref_filename)
+            if nr_diff or bad_blocks.shape[0]:
+                nr_failed += 1
+            logging.info(
+                "%s: %d bits differ, %d bad CRCs",
+                ref_filename,
+                nr_diff,
+                bad_blocks.shape[0],
+            )
+        return 1 if nr_failed else 0
+
+    if args.spec is None or args.output is None:
+        parser.error("spec and --output are needed without --check")
+
+    with open(args.spec, "r") as f:
+        spec = json.load(f)
+
+    addrs, vals = spec_to_bits(iocls, spec, _open_bitstream(args.base))
+    flips = write_patched(args.base, args.output, addrs, vals)
+    logging.info("%s: %d bits changed", args.output, flips.shape[0])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
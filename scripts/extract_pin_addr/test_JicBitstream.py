@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import JicCrc
+from JicBitstream import JicBitstream
+
+# an uncompressed image: the option bytes, then blocks of 1186 bytes + CRC16
+IMAGE_START = 77760
+BLK_DATA = 1186
+NR_BLKS = 4
+
+
+@pytest.fixture
+def jic_filename(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 256, (NR_BLKS, BLK_DATA), dtype=np.uint8)
+    data[:, 0] = 0
+    crc = JicCrc.crc16_rows(data)
+    blocks = np.concatenate(
+        [data, (crc & 0xFF).astype(np.uint8)[:, None], (crc >> 8)[:, None]], axis=1
+    )
+
+    image = np.zeros(IMAGE_START + blocks.size + 12, dtype=np.uint8)
+    image[96:100] = ord("j")
+    image[IMAGE_START : IMAGE_START + blocks.size] = blocks.reshape(-1)
+    image[-12:-8] = [0xAE, 0xFB, 0, 0]
+
+    filename = tmp_path / "test.jic"
+    filename.write_bytes(image.tobytes())
+    return str(filename)
+
+
+def _data_addr(blk, bit):
+    return 8 * (IMAGE_START + blk * (BLK_DATA + 2)) + bit
+
+
+def test_set_els_repeated_addrs(jic_filename):
+    jic = JicBitstream(jic_filename)
+    addr = _data_addr(1, 100)
+    val = 1 - jic.get_els([addr])[0]
+
+    # the first value wins
+    flips = jic.set_els([addr, addr, addr], [val, 1 - val, 1 - val])
+
+    assert list(flips) == [addr]
+    assert jic.get_els([addr])[0] == val
+    assert jic.bad_blocks().shape[0] == 0
+
+
+def test_set_els_scalar_val(jic_filename):
+    jic = JicBitstream(jic_filename)
+    addrs = np.array([_data_addr(0, 9), _data_addr(2, 8000), _data_addr(0, 9)])
+
+    jic.set_els(addrs, 1)
+
+    assert np.all(jic.get_els(addrs) == 1)
+    assert jic.bad_blocks().shape[0] == 0
+
+    jic.set_els(addrs.reshape(3, 1), 0)
+    assert np.all(jic.get_els(addrs) == 0)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import patch_bitstream
+from IOclassifier import IOSTD_REL_TO_PU, IOclassifier
+from patch_bitstream import spec_to_bits
+
+
+class FakeBitstream:
+    """Only the bits in `ones` are set"""
+
+    def __init__(self, ones=()):
+        self.ones = set(int(addr) for addr in ones)
+
+    def get_els(self, addrs):
+        return np.array([int(addr) in self.ones for addr in addrs], dtype=np.uint8)
+
+
+@pytest.fixture
+def iocls():
+    return IOclassifier()
+
+
+def _shared_feature(iocls):
+    """Relative addresses of a bit which is a feature of both R32 and P32"""
+
+    r32, p32 = iocls.get_feat_addrs(["R32", "P32"])
+    addr = np.intersect1d(r32, p32)[0]
+    return (
+        str(IOSTD_REL_TO_PU[np.flatnonzero(r32 == addr)[0]]),
+        str(IOSTD_REL_TO_PU[np.flatnonzero(p32 == addr)[0]]),
+        addr,
+    )
+
+
+def test_adjacent_pins(iocls):
+    r32, p32 = iocls.get_feat_addrs(["R32", "P32"])
+    idx_pu = patch_bitstream._feature_idx("pu")
+
+    addrs, vals = spec_to_bits(
+        iocls, {"R32": {"pu": 1}, "P32": {"pu": 1, "-512": 0}}, FakeBitstream()
+    )
+
+    assert dict(zip(addrs, vals)) == {
+        r32[idx_pu]: 1,
+        p32[idx_pu]: 1,
+        p32[patch_bitstream._feature_idx("-512")]: 0,
+    }
+
+
+def test_adjacent_pins_shared_bit(iocls):
+    r32_name, p32_name, addr = _shared_feature(iocls)
+
+    addrs, vals = spec_to_bits(
+        iocls, {"R32": {r32_name: 1}, "P32": {p32_name: 1}}, FakeBitstream()
+    )
+    assert list(addrs) == [addr] and list(vals) == [1]
+
+    with pytest.raises(ValueError, match="set to"):
+        spec_to_bits(
+            iocls, {"R32": {r32_name: 1}, "P32": {p32_name: 0}}, FakeBitstream()
+        )
+
+
+def test_adjacent_pins_copy(iocls, monkeypatch):
+    r32, p32 = iocls.get_feat_addrs(["R32", "P32"])
+    ref = FakeBitstream(p32)
+    monkeypatch.setattr(patch_bitstream, "_open_bitstream", lambda filename: ref)
+
+    # the bits of R32 which the reference leaves at the base value are kept
+    addrs, vals = spec_to_bits(
+        iocls, {"P32": "P32_ref.zip", "R32": {"pu": 1}}, FakeBitstream()
+    )
+
+    assert set(addrs) == set(p32) | {r32[patch_bitstream._feature_idx("pu")]}
+    assert np.all(vals == 1)
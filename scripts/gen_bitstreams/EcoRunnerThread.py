@@ -1,14 +1,20 @@
 #! /usr/bin/env python3
 
+import glob
 import os
+import shutil
 import subprocess
 import time
-import zipfile
 from distutils.dir_util import copy_tree
 from queue import Empty, Queue
 from string import Template
+from functools import partial
 from threading import Thread
 
+from JobJournal import JobJournal
+from QuartusShell import QuartusShell, QuartusShellCrashed, QuartusShellError
+from ResultArchiver import ResultArchiver, archive_results
+
 
 class EcoRunnerThread(Thread):
 
@@ -16,8 +22,34 @@ class EcoRunnerThread(Thread):
     RESULTS_SUBDIR = None
     WORK_PRJ_DIR = "../../work/base_project"
     LOG_DIR = "../../work/log"
+    JOURNAL_DIR = "../../work"
     SCRIPT_DIR = "../../work/script"
     RESULTS_DIR = "../../results/"
+    ECO_PROCS_FILENAME = "eco_procs.tcl"
+
+    # run the ECOs in a long-lived quartus_cdb shell (see QuartusShell), the
+    # project is opened and the netlist read only once between compilations;
+    # if False, every ECO runs in a new quartus_cdb (eco.tcl, eco_batch.tcl).
+    # Only tested against fake_quartus_sh.tcl so far, off until it is tried
+    # with Quartus
+    PERSISTENT_SHELL = False
+
+    # converts and zips the results in the background, shared by all the
+    # threads (see `start_archiver`); if None, `store_results` does it
+    archiver = None
+
+    # admits a compilation (or a Qsys generation) only if there is enough free
+    # memory for it, shared by all the threads (see MemoryScheduler); if None,
+    # runs it right away
+    scheduler = None
+
+    # the stored results and the completed items, shared by all the threads
+    # (see `open_journal`); if None, nothing is skipped
+    journal = None
+
+    # the snapshots of the earlier runs (snapshots_<time>) which are kept, the
+    # older ones are removed
+    OLD_SNAPSHOTS_KEPT = 3
 
     def __init__(self, thread_idx: int, work_queue: Queue):
         super().__init__(name=f"eco_runner_{thread_idx}")
@@ -32,13 +64,23 @@ class EcoRunnerThread(Thread):
 
         # prepare paths
         self.prj_dir = f"{self.WORK_PRJ_DIR}_{self.thread_idx}"
-        self.output_filename_full = os.path.join(
-            self.prj_dir, "output_files", "base_project.jic"
+        self.sof_filename_full = os.path.join(
+            self.prj_dir, "output_files", "base_project.sof"
         )
+        self.snapshot_dir = os.path.join(self.prj_dir, "output_files", "snapshots")
+        self.quartus_prj_dir = os.path.join(self.prj_dir, "project", "base_project")
 
-        # create a folder for the results
+        self.shell = None
+        self.shell_prj_open = False
+
+        # the current work item (see `begin_item`) and its results
+        self.item = None
+        self.item_results = []
+
+        # create a folder for the results (it exists when resuming a sweep)
         if thread_idx == 0:
-            os.mkdir(os.path.join(self.RESULTS_DIR, self.RESULTS_SUBDIR))
+            results_dir = os.path.join(self.RESULTS_DIR, self.RESULTS_SUBDIR)
+            os.makedirs(results_dir, exist_ok=True)
 
         # prepare base project
         copy_tree(self.BASE_PRJ_DIR, self.prj_dir)
@@ -48,6 +90,25 @@ class EcoRunnerThread(Thread):
         log_path = os.path.join(self.LOG_DIR, log_name)
         self.f_log = open(log_path, "w", buffering=1)
 
+        # the snapshots of an interrupted run and the job dirs of the failed
+        # archivings are moved aside, to be looked at
+        if os.path.exists(self.snapshot_dir):
+            old_snapshot_dir = f"{self.snapshot_dir}_{int(time.time())}"
+            os.rename(self.snapshot_dir, old_snapshot_dir)
+            self.f_log.write(f"> leftover snapshots moved to {old_snapshot_dir}\n")
+        self._remove_old_snapshots()
+
+    def _remove_old_snapshots(self):
+        """Removes all but the last `OLD_SNAPSHOTS_KEPT` snapshots_<time> dirs"""
+
+        old_snapshot_dirs = sorted(
+            glob.glob(f"{self.snapshot_dir}_*"),
+            key=lambda dirname: int(dirname.rsplit("_", 1)[1]),
+        )
+        for dirname in old_snapshot_dirs[: -self.OLD_SNAPSHOTS_KEPT or None]:
+            self.f_log.write(f"> removing old snapshots {dirname}\n")
+            shutil.rmtree(dirname, ignore_errors=True)
+
     def _gen_eco(self, info_type, value, node):
         """Generate eco.tcl file to be used with quartus_cdb
 
@@ -87,45 +148,126 @@ class EcoRunnerThread(Thread):
             self.f_log.write(f"> run_eco failed with rc = {rc}\n")
             raise RuntimeError("Running ECO failed")
 
-    def _gen_cof(self):
-        """Generate .cof file to be used with `quartus_cpf`  """
+    def _eco_step_tcl(self, changes, sof_filename=None):
+        """Tcl lines of an ECO step (see eco_procs.tcl)
 
-        self.f_log.write("> gen_cof\n")
+        Args:
+            changes: list of (info_type, value, node), quoted as for `_gen_eco`
+            sof_filename: the .sof is copied there after the netlist is saved
+        """
+
+        lines = [
+            f"set_info {node} {info_type} {value}" for info_type, value, node in changes
+        ]
+        if sof_filename is None:
+            lines.append("check_and_save")
+        else:
+            lines.append(f'snapshot "{self.sof_filename_full}" "{sof_filename}"')
+        return lines
 
-        quartus_out_dir = os.path.join(self.prj_dir, "output_files")
+    def _gen_eco_batch(self, steps):
+        """Generate eco_batch.tcl, all the steps are done in one quartus_cdb session
 
-        conv_to_jic_temp = Template(open("conv_to_jic.cof.template", "r").read())
-        conv_to_jic_str = conv_to_jic_temp.substitute(
-            templ_quartus_out_dir=quartus_out_dir,
-            templ_output_filename=self.output_filename_full,
+        Args:
+            steps: list of (changes, sof_filename), see `_eco_step_tcl`
+        """
+
+        self.f_log.write("> gen_eco_batch\n")
+
+        lines = []
+        for idx, (changes, sof_filename) in enumerate(steps):
+            lines.append(f"# step {idx}")
+            lines.extend(self._eco_step_tcl(changes, sof_filename))
+            lines.append("")
+
+        eco_tcl_temp = Template(open("eco_batch.tcl.template", "r").read())
+        eco_tcl_str = eco_tcl_temp.substitute(
+            templ_quartus_prj_dir=self.quartus_prj_dir,
+            templ_procs_filename=os.path.abspath(self.ECO_PROCS_FILENAME),
+            templ_steps="\n".join(lines),
         )
 
-        open(self._get_cof_filename(), "w").write(conv_to_jic_str)
+        open(self._get_eco_filename(), "w").write(eco_tcl_str)
 
-    def _run_cof(self):
-        """ Run `quartus_cpf` """
+    def _shell_run(self, lines):
+        """Runs Tcl lines in the persistent shell, with the project open
 
-        self.f_log.write("> run_cof\n")
+        If the shell crashes, it is respawned and the lines are run once more
+        (the node infos are set to absolute values, so a partially applied
+        step can be redone).
+        """
 
-        subprocess.call(
-            ["quartus_cpf", "-c", self._get_cof_filename()],
-            stderr=subprocess.STDOUT,
-            bufsize=1,
-            universal_newlines=True,
-            stdout=self.f_log,
+        script = "\n".join(["set had_failure 0"] + lines + ["set had_failure"])
+
+        init_script = "\n".join(
+            [
+                "package require ::quartus::chip_planner",
+                "package require ::quartus::project",
+                "load_chip_planner_utility_commands",
+                f"source {{{os.path.abspath(self.ECO_PROCS_FILENAME)}}}",
+            ]
         )
 
+        for attempt in range(2):
+            try:
+                if self.shell is None:
+                    self.shell = QuartusShell(
+                        init_script,
+                        name=f"shell_{self.thread_idx}",
+                        script_dir=self.SCRIPT_DIR,
+                        f_log=self.f_log,
+                    )
+
+                if not self.shell_prj_open:
+                    self.shell.run(
+                        f"project_open {{{self.quartus_prj_dir}}}"
+                        " -revision base_project\nread_netlist"
+                    )
+                    self.shell_prj_open = True
+
+                _, had_failure = self.shell.run(script)
+                break
+            except QuartusShellCrashed:
+                self.shell_prj_open = False
+                if attempt == 1:
+                    raise RuntimeError("Running ECO failed")
+            except QuartusShellError as exc:
+                self.f_log.write(f"> shell script failed: {exc}\n")
+                raise RuntimeError("Running ECO failed")
+
+        if had_failure == "1":
+            self.f_log.write("Not all set operations were successful\n")
+
+    def _shell_close_project(self):
+        """Closes the project in the shell, before Quartus is run on it otherwise"""
+
+        if self.shell is not None and self.shell_prj_open:
+            self.shell_prj_open = False
+            try:
+                self.shell.run("project_close")
+            except (QuartusShellCrashed, QuartusShellError) as exc:
+                # the project state is unknown, a new shell is started when needed
+                self.f_log.write(f"> project_close failed: {exc}\n")
+                self.shell.close()
+                self.shell = None
+
+    def close_shell(self):
+        if self.shell is not None:
+            self._shell_close_project()
+            self.shell.close()
+            self.shell = None
+
     def _get_eco_filename(self):
         return os.path.join(self.SCRIPT_DIR, f"eco_{self.thread_idx}.tcl")
 
-    def _get_cof_filename(self):
-        return os.path.join(self.SCRIPT_DIR, f"conv_to_jic_{self.thread_idx}.cof")
+    def _call_script(self, script):
+        """Runs a script of the project, admitted by the scheduler (if set)
 
-    def compile_fpga_project(self):
-        """ Compile FPGA project """
+        Returns:
+            return code of the script
+        """
 
-        rc = subprocess.call(
-            ["./compile.sh"],
+        kwargs = dict(
             cwd=os.path.join(self.prj_dir, "scripts"),
             stderr=subprocess.STDOUT,
             bufsize=1,
@@ -133,6 +275,16 @@ class EcoRunnerThread(Thread):
             stdout=self.f_log,
         )
 
+        if self.scheduler is None:
+            return subprocess.call([script], **kwargs)
+        return self.scheduler.call([script], f_log=self.f_log, **kwargs)
+
+    def compile_fpga_project(self):
+        """ Compile FPGA project """
+
+        self._shell_close_project()
+
+        rc = self._call_script("./compile.sh")
         if rc != 0:
             self.f_log.write(f"> compile_fpga_project failed with rc = {rc}\n")
             raise RuntimeError("Compilation failed")
@@ -141,16 +293,9 @@ class EcoRunnerThread(Thread):
         """ Only for the bidir project """
 
         self.f_log.write(f"> gen_qsys\n")
+        self._shell_close_project()
 
-        rc = subprocess.call(
-            ["./gen_qsys.sh"],
-            cwd=os.path.join(self.prj_dir, "scripts"),
-            stderr=subprocess.STDOUT,
-            bufsize=1,
-            universal_newlines=True,
-            stdout=self.f_log,
-        )
-
+        rc = self._call_script("./gen_qsys.sh")
         if rc != 0:
             self.f_log.write(f"> gen_qsys failed with rc = {rc}\n")
             raise RuntimeError("Gen Qsys failed")
@@ -158,10 +303,68 @@ class EcoRunnerThread(Thread):
     def eco(self, info_type, value, node="|base_project|test_pin"):
         self.f_log.write(f"> eco {info_type} {value}\n")
 
+        if self.PERSISTENT_SHELL:
+            self._shell_run(self._eco_step_tcl([(info_type, value, node)]))
+            return
+
         self._gen_eco(info_type, value, node)
         self._run_eco()
 
+    def eco_batch(self, steps, node="|base_project|test_pin"):
+        """Apply a sequence of ECO changes and store the results after every step
+
+        Same as calling `eco` for every change and `store_results` after
+        every step, but the project is opened (and the netlist read) only
+        once; the .sof of every step is copied to a snapshot and converted
+        afterwards.
+
+        Args:
+            steps: list of (changes, out_file), every change is
+                (info_type, value) or (info_type, value, node); the changes
+                are applied on top of the previous steps
+        """
+
+        # the steps build on each other, only the ones after the last missing
+        # result can be left out
+        nr_steps = len(steps)
+        while nr_steps > 0 and self._results_done([steps[nr_steps - 1][1]]):
+            nr_steps -= 1
+        steps = steps[:nr_steps]
+
+        self.f_log.write(f"> eco_batch {len(steps)} steps\n")
+
+        if self.PERSISTENT_SHELL:
+            # the shell is kept open, the results are stored after every step
+            for changes, out_file in steps:
+                changes = [(change + (node,))[:3] for change in changes]
+                self._shell_run(self._eco_step_tcl(changes))
+                self.store_results(out_file)
+            return
+
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+        tcl_steps = []
+        for changes, out_file in steps:
+            changes = [(change + (node,))[:3] for change in changes]
+            sof_filename = os.path.join(
+                self.snapshot_dir, os.path.splitext(out_file)[0] + ".sof"
+            )
+            tcl_steps.append((changes, sof_filename))
+
+        self._gen_eco_batch(tcl_steps)
+        self._run_eco()
+
+        for (_, out_file), (_, sof_filename) in zip(steps, tcl_steps):
+            if not os.path.exists(sof_filename):
+                self.f_log.write(f"> eco_batch missing snapshot {sof_filename}\n")
+                raise RuntimeError("Running ECO batch failed")
+
+            self.store_results(out_file, sof_filename)
+
     def _modify_qsf_file(self, func, append_lines=None):
+        # Quartus writes the .qsf when the project is closed
+        self._shell_close_project()
+
         qsf_filename = os.path.join(self.prj_dir, "project/base_project.qsf")
         with open(qsf_filename) as f_in:
             lines = f_in.readlines()
@@ -260,39 +463,131 @@ class EcoRunnerThread(Thread):
 
         self._modify_qsf_file(f, None)
 
-    def store_results(self, out_file):
-        self.f_log.write(f"> store results: {out_file}\n")
+    @classmethod
+    def start_archiver(cls, **kwargs):
+        """Starts converting and zipping the results in the background"""
+        cls.archiver = ResultArchiver(cls.LOG_DIR, **kwargs)
 
-        self._gen_cof()
-        self._run_cof()
+    @classmethod
+    def stop_archiver(cls):
+        """Waits until all the results are stored"""
 
-        out_file_full = os.path.join(self.RESULTS_DIR, self.RESULTS_SUBDIR, out_file)
+        archiver, cls.archiver = cls.archiver, None
+        if archiver is not None:
+            archiver.close()
 
-        stat = os.stat(self.output_filename_full)
-        self.f_log.write(f"stat {out_file}: {stat}\n")
+    @classmethod
+    def open_journal(cls):
+        """Opens the journal of the results (and resumes the sweep)"""
 
-        with zipfile.ZipFile(
-            out_file_full, mode="w", compression=zipfile.ZIP_LZMA
-        ) as zp:
-            basename = os.path.basename(self.output_filename_full)
+        cls.journal = JobJournal(
+            os.path.join(cls.JOURNAL_DIR, f"journal_{cls.RESULTS_SUBDIR}.jsonl"),
+            os.path.join(cls.RESULTS_DIR, cls.RESULTS_SUBDIR),
+        )
 
-            jic_bytes = open(self.output_filename_full, "rb").read()
-            with zp.open(basename, "w") as jic:
-                jic.write(jic_bytes)
+    @classmethod
+    def close_journal(cls):
+        """Closes the journal, after `stop_archiver` (the archiver records the
+        results)"""
 
-            pin_filename = os.path.join(
-                self.prj_dir, "output_files", "base_project.pin"
-            )
-            pin_bytes = open(pin_filename, "rb").read()
-            with zp.open("pin.txt", "w") as pin:
-                pin.write(pin_bytes)
+        journal, cls.journal = cls.journal, None
+        if journal is not None:
+            journal.close()
 
-            rpt_filename = os.path.join(
-                self.prj_dir, "output_files", "base_project.fit.rpt"
-            )
-            rpt_bytes = open(rpt_filename, "rb").read()
-            with zp.open("fit_report.txt", "w") as rpt:
-                rpt.write(rpt_bytes)
+    def begin_item(self, item):
+        """Starts a work item (e.g. a pin)
+
+        Returns:
+            False if the item was completed (and all its results are intact)
+            in an earlier run, and should be skipped
+        """
+
+        self.item, self.item_results = item, []
+
+        if self.journal is not None and self.journal.is_item_done(item):
+            self.log_to_file(f"skipping {item}, completed in an earlier run")
+            return False
+        return True
+
+    def _results_done(self, out_files):
+        """True if all the results were stored in an earlier run (they are
+        counted as the results of the current item)"""
+
+        if self.journal is None:
+            return False
+        if not all(self.journal.is_result_done(out_file) for out_file in out_files):
+            return False
+
+        self.log_to_file(f"skipping {', '.join(out_files)}, stored in an earlier run")
+        self.item_results.extend(out_files)
+        return True
+
+    def compile_and_store(self, out_file, steps=()):
+        """Compiles the project, stores the results and runs the ECO steps on top
+
+        Nothing is done if all the results (also of the steps, see `eco_batch`)
+        were stored in an earlier run.
+        """
+
+        out_files = [out_file] + [step_out_file for _, step_out_file in steps]
+        if self._results_done(out_files):
+            return
+
+        self.compile_fpga_project()
+        self.store_results(out_file)
+        if steps:
+            self.eco_batch(steps)
+
+    def end_item(self):
+        if self.journal is not None:
+            self.journal.record_item(self.item, self.item_results)
+
+    def store_results(self, out_file, sof_filename=None):
+        """Stores the .jic (converted from the .sof), the .pin and the fit report
+
+        The files are copied to a job dir, so that the project can be compiled
+        again while the archiver (if started) converts and zips them.
+
+        Args:
+            sof_filename: .sof to convert, moved to the job dir; by default the
+                .sof of the project (copied)
+        """
+
+        self.f_log.write(f"> store results: {out_file}\n")
+
+        self.item_results.append(out_file)
+        on_done = None
+
+        if self.journal is not None:
+            if self.journal.is_result_done(out_file):
+                self.f_log.write("> stored in an earlier run, skipping\n")
+                if sof_filename is not None:
+                    os.remove(sof_filename)
+                return
+
+            on_done = partial(self.journal.record_result, out_file)
+
+        out_file_full = os.path.join(self.RESULTS_DIR, self.RESULTS_SUBDIR, out_file)
+        job_dir = os.path.join(self.snapshot_dir, os.path.splitext(out_file)[0])
+        os.makedirs(job_dir, exist_ok=True)
+
+        output_dir = os.path.join(self.prj_dir, "output_files")
+        for filename in ["base_project.pin", "base_project.fit.rpt"]:
+            shutil.copy(os.path.join(output_dir, filename), job_dir)
+
+        job_sof_filename = os.path.join(job_dir, "base_project.sof")
+        if sof_filename is None:
+            shutil.copy(self.sof_filename_full, job_sof_filename)
+        else:
+            shutil.move(sof_filename, job_sof_filename)
+
+        if self.archiver is None:
+            archive_results(job_dir, out_file_full, self.f_log)
+            shutil.rmtree(job_dir)
+            if on_done is not None:
+                on_done()
+        else:
+            self.archiver.submit(job_dir, out_file_full, on_done)
 
     def log_to_file(self, msg):
         self.f_log.write(f"# {msg}\n")
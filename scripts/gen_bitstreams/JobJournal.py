@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+
+
+class JobJournal:
+    """Append-only journal (JSON lines) of the stored results and the completed items
+
+    Two kinds of records:
+
+        {"result": "R32_2V5.zip", "size": ..., "sha256": ..., "time": ...}
+        {"item": "R32", "results": ["R32_2V5.zip", ...], "time": ...}
+
+    A result counts as done only if the file is still there with the same
+    checksum, an item only if all its results are done; so a sweep can be
+    restarted after a crash, and only the partial items are redone. The
+    checksum of a file is computed once, again only if its size or mtime
+    changes.
+    """
+
+    def __init__(self, filename, results_dir):
+        """
+        Args:
+            filename: the journal (.jsonl), created if it doesn't exist
+            results_dir: the results are relative to this dir
+        """
+
+        self.filename = filename
+        self.results_dir = results_dir
+        self.results = {}
+        self.items = {}
+        # result -> ((size, mtime), checksum matches), of the checked files
+        self._verified = {}
+        self._lock = Lock()
+
+        if os.path.exists(filename):
+            self._load()
+
+        self._f = open(filename, "a", buffering=1)
+        if self._f.tell() > 0 and not self._ends_with_newline():
+            # the last record was cut by a crash
+            self._f.write("\n")
+
+    def _ends_with_newline(self):
+        with open(self.filename, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _load(self):
+        with open(self.filename, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                if "result" in record:
+                    self.results[record["result"]] = record
+                elif "item" in record:
+                    self.items[record["item"]] = record
+
+    def _append(self, record):
+        record["time"] = time.time()
+
+        with self._lock:
+            self._f.write(json.dumps(record) + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    @staticmethod
+    def checksum(filename):
+        sha = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def record_result(self, result):
+        """Records a result which was just (completely) written"""
+
+        filename = os.path.join(self.results_dir, result)
+        stat = os.stat(filename)
+        record = {
+            "result": result,
+            "size": stat.st_size,
+            "sha256": self.checksum(filename),
+        }
+        self._append(record)
+        with self._lock:
+            self.results[result] = record
+            self._verified[result] = ((stat.st_size, stat.st_mtime_ns), True)
+
+    def is_result_done(self, result):
+        with self._lock:
+            record = self.results.get(result)
+        if record is None:
+            return False
+
+        filename = os.path.join(self.results_dir, result)
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != record["size"]:
+            return False
+
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            verified = self._verified.get(result)
+        if verified is not None and verified[0] == key:
+            return verified[1]
+
+        ok = self.checksum(filename) == record["sha256"]
+        with self._lock:
+            self._verified[result] = (key, ok)
+        return ok
+
+    def record_item(self, item, results):
+        """Records a completed item (e.g. a pin) and all the results it stored"""
+
+        record = {"item": item, "results": list(results)}
+        self._append(record)
+        with self._lock:
+            self.items[item] = record
+
+    def is_item_done(self, item):
+        with self._lock:
+            record = self.items.get(item)
+        if record is None:
+            return False
+
+        return all(self.is_result_done(result) for result in record["results"])
+
+    def close(self):
+        self._f.close()
@@ -0,0 +1,163 @@
+import subprocess
+import time
+from threading import Condition
+
+import psutil
+
+GiB = 1 << 30
+
+
+class MemoryScheduler:
+    """Admits a new job (e.g. a compilation) only if there is enough free memory
+
+    A job is admitted if the available memory (`psutil.virtual_memory`) is
+    enough for the peak of the new job, for the running jobs to grow to their
+    peak and for a reserve. The peak is configured or, by default, learned:
+    the RSS of the process tree of every job is sampled and the largest peak
+    seen is used (initially `JOB_PEAK`).
+
+    While the jobs run, the used swap is sampled too; no job is admitted while
+    it grows faster than `SWAP_GROWTH_RATE` (the running jobs are being
+    swapped out, the estimate was too low or something else needs memory).
+
+    A job which doesn't fit waits and tries again after `POLL_INTERVAL`;
+    it is always admitted if no other job runs (it could never fit otherwise).
+    """
+
+    # initial estimate of the peak memory of a job (the fitter)
+    JOB_PEAK = 12 * GiB
+    # headroom kept free, for the OS and the other processes
+    RESERVE = 2 * GiB
+    # the learned peak is increased by this factor
+    PEAK_MARGIN = 1.1
+    # s, between the memory samples and the admission attempts
+    POLL_INTERVAL = 5
+    # bytes/s, the admission is held while the used swap grows faster
+    SWAP_GROWTH_RATE = 16 << 20
+
+    def __init__(self, job_peak=None, reserve=None):
+        """
+        Args:
+            job_peak: fixed peak memory of a job (bytes), learned if None
+            reserve: headroom (bytes), `RESERVE` if None
+        """
+
+        self.job_peak = job_peak
+        self.reserve = self.RESERVE if reserve is None else reserve
+        self.learned_peak = None
+
+        self._cond = Condition()
+        # RSS of the running jobs, by job id
+        self._running = {}
+        self._next_id = 0
+
+        # last sample of the used swap (time, bytes) and its growth (bytes/s)
+        self._swap_sample = None
+        self.swap_growth = 0.0
+
+    @property
+    def peak_estimate(self):
+        if self.job_peak is not None:
+            return self.job_peak
+        if self.learned_peak is None:
+            return self.JOB_PEAK
+        return int(self.learned_peak * self.PEAK_MARGIN)
+
+    def _sample_swap(self):
+        """Updates `swap_growth`, at most once per `POLL_INTERVAL` (holds _cond)"""
+
+        now = time.monotonic()
+        if self._swap_sample is not None:
+            dt = now - self._swap_sample[0]
+            if dt < self.POLL_INTERVAL:
+                return
+
+        used = psutil.swap_memory().used
+        if self._swap_sample is not None:
+            self.swap_growth = (used - self._swap_sample[1]) / dt
+        self._swap_sample = (now, used)
+
+    def _fits(self):
+        if self.swap_growth > self.SWAP_GROWTH_RATE:
+            return False
+
+        peak = self.peak_estimate
+        growth = sum(max(peak - rss, 0) for rss in self._running.values())
+        available = psutil.virtual_memory().available
+        return available - growth - self.reserve >= peak
+
+    def _admit(self, f_log=None):
+        with self._cond:
+            while self._running and not self._fits():
+                self._cond.wait(self.POLL_INTERVAL)
+
+            job_id = self._next_id
+            self._next_id += 1
+            self._running[job_id] = 0
+
+            if f_log is not None:
+                avail = psutil.virtual_memory().available
+                f_log.write(
+                    f"> admitted, {len(self._running)} running, "
+                    f"available {avail / GiB:.1f} GiB, "
+                    f"peak estimate {self.peak_estimate / GiB:.1f} GiB, "
+                    f"swap growth {self.swap_growth / (1 << 20):.1f} MiB/s\n"
+                )
+            return job_id
+
+    def _release(self, job_id, peak_rss):
+        with self._cond:
+            del self._running[job_id]
+            # no sample (e.g. the process didn't start), nothing to learn
+            if peak_rss > 0 and peak_rss > (self.learned_peak or 0):
+                self.learned_peak = peak_rss
+            self._cond.notify_all()
+
+    @staticmethod
+    def tree_rss(pid):
+        """RSS of a process and all its children (bytes)"""
+
+        rss = 0
+        try:
+            proc = psutil.Process(pid)
+            procs = [proc] + proc.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return rss
+
+        for p in procs:
+            try:
+                rss += p.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return rss
+
+    def call(self, args, f_log=None, **kwargs):
+        """Same as `subprocess.call`, but the process is admitted first
+
+        Returns:
+            return code of the process
+        """
+
+        job_id = self._admit(f_log)
+        peak_rss = 0
+
+        try:
+            with subprocess.Popen(args, **kwargs) as popen:
+                while True:
+                    rss = self.tree_rss(popen.pid)
+                    peak_rss = max(peak_rss, rss)
+                    with self._cond:
+                        self._running[job_id] = rss
+                        self._sample_swap()
+
+                    try:
+                        rc = popen.wait(self.POLL_INTERVAL)
+                        break
+                    except subprocess.TimeoutExpired:
+                        pass
+        finally:
+            self._release(job_id, peak_rss)
+
+        if f_log is not None:
+            f_log.write(f"> peak rss {peak_rss / GiB:.1f} GiB\n")
+        return rc
@@ -0,0 +1,253 @@
+#! /usr/bin/env python3
+
+"""Long-lived Quartus Tcl shell (`quartus_cdb -s`), driven over stdin/stdout
+
+Every request is a Tcl script, written to a file and sourced by the shell,
+the output of the script is framed by markers with the request id and the
+return code of the script:
+
+    <output>
+    @@RESULT <id>@@
+    <result>
+    @@DONE <id> <rc>@@
+
+If the shell exits (or does not answer in time) it is started again and the
+init script is replayed, the request fails with QuartusShellCrashed.
+
+For testing without Quartus, `fake_quartus_sh.tcl` is a stand-in for the
+shell with stubs of the ECO commands:
+
+    ./QuartusShell.py    # runs some requests on tclsh fake_quartus_sh.tcl
+"""
+
+import itertools
+import os
+import subprocess
+import tempfile
+from queue import Empty, Queue
+from threading import Thread
+
+
+class QuartusShellError(RuntimeError):
+    """The Tcl script of the request failed"""
+
+
+class QuartusShellCrashed(RuntimeError):
+    """The shell exited or timed out during the request (it was respawned)"""
+
+
+class QuartusShell:
+
+    SHELL_CMD = ["quartus_cdb", "-s"]
+    FAKE_SHELL_CMD = ["tclsh", "fake_quartus_sh.tcl"]
+
+    # s, a check_netlist_and_save can take a few minutes on a big design
+    TIMEOUT = 3600
+    CLOSE_TIMEOUT = 60
+
+    def __init__(
+        self, init_script="", cmd=None, name="shell", script_dir=None, f_log=None
+    ):
+        """
+        Args:
+            init_script: Tcl run after every (re)spawn, e.g. package loading
+            cmd: command starting the shell, `SHELL_CMD` by default
+            name: used for the request script filename
+            script_dir: where the request script is written, tmp by default
+            f_log: file the output of the shell is written to
+        """
+
+        self.cmd = cmd or self.SHELL_CMD
+        self.init_script = init_script
+        self.script_filename = os.path.abspath(
+            os.path.join(script_dir or tempfile.gettempdir(), f"{name}.tcl")
+        )
+        self.f_log = f_log
+
+        self.proc = None
+        self.nr_spawns = 0
+        self._req_ids = itertools.count()
+        self._spawn()
+
+    def _log(self, msg):
+        if self.f_log is not None:
+            self.f_log.write(msg)
+
+    def _spawn(self):
+        self._log(f"> shell spawn {' '.join(self.cmd)}\n")
+
+        self.proc = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=1,
+            universal_newlines=True,
+        )
+        self.nr_spawns += 1
+
+        # stdout is read in a thread, so that a hung shell can be timed out
+        self._lines = Queue()
+        Thread(
+            target=self._read_lines, args=(self.proc.stdout, self._lines), daemon=True
+        ).start()
+
+        if self.init_script:
+            try:
+                self._request(self.init_script)
+            except (QuartusShellCrashed, QuartusShellError):
+                self._kill()
+                raise
+
+    @staticmethod
+    def _read_lines(stdout, lines):
+        for line in stdout:
+            lines.put(line)
+        lines.put(None)
+
+    def _kill(self):
+        if self.proc is None:
+            return
+
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        self.proc = None
+
+    def respawn(self):
+        self._kill()
+        self._spawn()
+
+    def _request(self, script, timeout=None):
+        req_id = next(self._req_ids)
+        timeout = timeout or self.TIMEOUT
+
+        with open(self.script_filename, "w") as f:
+            f.write(script)
+
+        frame = (
+            f"set __rc [catch {{source {{{self.script_filename}}}}} __res]; "
+            f'puts "@@RESULT {req_id}@@"; puts $__res; '
+            f'puts "@@DONE {req_id} $__rc@@"; flush stdout\n'
+        )
+
+        try:
+            self.proc.stdin.write(frame)
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise QuartusShellCrashed(f"shell exited, rc = {self.proc.wait()}")
+
+        output, result = [], None
+        while True:
+            try:
+                line = self._lines.get(timeout=timeout)
+            except Empty:
+                self._kill()
+                raise QuartusShellCrashed(f"no answer in {timeout} s")
+
+            if line is None:
+                raise QuartusShellCrashed(f"shell exited, rc = {self.proc.wait()}")
+
+            self._log(line)
+
+            # the marker may follow a prompt or output without a newline
+            if f"@@RESULT {req_id}@@" in line:
+                output.append(line.split(f"@@RESULT {req_id}@@")[0])
+                result = []
+            elif f"@@DONE {req_id} " in line:
+                rc = int(line.split(f"@@DONE {req_id} ")[1].split("@@")[0])
+                break
+            elif result is not None:
+                result.append(line)
+            else:
+                output.append(line)
+
+        output, result = "".join(output).rstrip("\n"), "".join(result).rstrip("\n")
+
+        if rc == 1:
+            raise QuartusShellError(result)
+
+        return output, result
+
+    def run(self, script, timeout=None):
+        """Runs a Tcl script in the shell
+
+        If the shell was killed (e.g. after a timeout, which was raised as
+        QuartusShellCrashed), a new one is started first.
+
+        Returns:
+            output of the script and its result (both str)
+
+        Raises:
+            QuartusShellError: the script failed
+            QuartusShellCrashed: the shell exited or timed out, a new one was
+                started (with the init script) before raising
+        """
+
+        if self.proc is None:
+            self._log("> shell not running\n")
+            self.respawn()
+
+        try:
+            return self._request(script, timeout)
+        except QuartusShellCrashed as exc:
+            self._log(f"> shell crashed: {exc}\n")
+            self.respawn()
+            raise
+
+    def close(self):
+        if self.proc is not None and self.proc.poll() is None:
+            try:
+                self.proc.stdin.write("exit\n")
+                self.proc.stdin.flush()
+                self.proc.wait(self.CLOSE_TIMEOUT)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        self._kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    """Smoke test against the fake shell"""
+
+    init = "package require ::quartus::project\nset inits [incr inits]"
+
+    with QuartusShell(init, cmd=QuartusShell.FAKE_SHELL_CMD) as shell:
+        output, result = shell.run('puts "hello"\nexpr 6 * 7')
+        assert (output, result) == ("hello", "42"), (output, result)
+
+        try:
+            shell.run("error boom")
+            raise AssertionError("no QuartusShellError")
+        except QuartusShellError as exc:
+            assert str(exc) == "boom"
+
+        try:
+            shell.run("crash 3")
+            raise AssertionError("no QuartusShellCrashed")
+        except QuartusShellCrashed:
+            pass
+
+        assert shell.nr_spawns == 2
+        assert shell.run("set inits")[1] == "1"
+
+        # killed (e.g. by a timeout) without a respawn
+        shell._kill()
+        assert shell.run("expr 1 + 1")[1] == "2"
+        assert shell.nr_spawns == 3
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
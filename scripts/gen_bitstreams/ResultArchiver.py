@@ -0,0 +1,117 @@
+import os
+import shutil
+import subprocess
+import time
+import zipfile
+from queue import Queue
+from string import Template
+from threading import Lock, Thread
+
+
+def archive_results(job_dir, out_file_full, f_log):
+    """Converts the .sof in `job_dir` to .jic and zips it with the .pin and fit report
+
+    Args:
+        job_dir: contains base_project.sof, base_project.pin and
+            base_project.fit.rpt, the .cof and the .jic are generated there
+        out_file_full: the .zip
+    """
+
+    sof_filename = os.path.join(job_dir, "base_project.sof")
+    jic_filename = os.path.join(job_dir, "base_project.jic")
+    cof_filename = os.path.join(job_dir, "conv_to_jic.cof")
+
+    f_log.write(f"> gen_cof {out_file_full}\n")
+
+    conv_to_jic_temp = Template(open("conv_to_jic.cof.template", "r").read())
+    conv_to_jic_str = conv_to_jic_temp.substitute(
+        templ_sof_filename=sof_filename, templ_output_filename=jic_filename,
+    )
+    open(cof_filename, "w").write(conv_to_jic_str)
+
+    f_log.write("> run_cof\n")
+
+    rc = subprocess.call(
+        ["quartus_cpf", "-c", cof_filename],
+        stderr=subprocess.STDOUT,
+        bufsize=1,
+        universal_newlines=True,
+        stdout=f_log,
+    )
+
+    if rc != 0:
+        f_log.write(f"> run_cof failed with rc = {rc}\n")
+        raise RuntimeError(f"quartus_cpf failed with rc = {rc}")
+
+    stat = os.stat(jic_filename)
+    f_log.write(f"stat {os.path.basename(out_file_full)}: {stat}\n")
+
+    with zipfile.ZipFile(out_file_full, mode="w", compression=zipfile.ZIP_LZMA) as zp:
+        for filename, arcname in [
+            ("base_project.jic", "base_project.jic"),
+            ("base_project.pin", "pin.txt"),
+            ("base_project.fit.rpt", "fit_report.txt"),
+        ]:
+            file_bytes = open(os.path.join(job_dir, filename), "rb").read()
+            with zp.open(arcname, "w") as f:
+                f.write(file_bytes)
+
+
+class ResultArchiver:
+    """Pool of threads running `archive_results` in the background
+
+    The queue is bounded, `submit` blocks when the pool is behind (so the
+    snapshots waiting for the conversion don't fill the disk).
+    """
+
+    THREAD_COUNT = 2
+    QUEUE_SIZE = 8
+
+    def __init__(self, log_dir, thread_count=None, queue_size=None):
+        self.log_dir = log_dir
+        self.jobs = Queue(maxsize=queue_size or self.QUEUE_SIZE)
+        self.failed = []
+        self._lock = Lock()
+
+        self.threads = [
+            Thread(target=self._worker, args=(idx,), name=f"archiver_{idx}")
+            for idx in range(thread_count or self.THREAD_COUNT)
+        ]
+        [thread.start() for thread in self.threads]
+
+    def _worker(self, idx):
+        log_name = f"log_archiver_{idx}_{int(time.time())}.txt"
+        with open(os.path.join(self.log_dir, log_name), "w", buffering=1) as f_log:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    return
+
+                job_dir, out_file_full, on_done = job
+                try:
+                    archive_results(job_dir, out_file_full, f_log)
+                    shutil.rmtree(job_dir)
+                    if on_done is not None:
+                        on_done()
+                except Exception as exc:
+                    # the job dir is kept, to be looked at
+                    f_log.write(f"> archiving {out_file_full} failed: {exc!r}\n")
+                    with self._lock:
+                        self.failed.append(out_file_full)
+
+    def submit(self, job_dir, out_file_full, on_done=None):
+        """Archives the results in `job_dir` (see `archive_results`), removes the dir
+
+        Args:
+            on_done: called (in the pool) once the .zip is written
+        """
+        self.jobs.put((job_dir, out_file_full, on_done))
+
+    def close(self):
+        """Waits for all the submitted jobs, raises if any of them failed"""
+
+        [self.jobs.put(None) for _ in self.threads]
+        [thread.join() for thread in self.threads]
+
+        if self.failed:
+            raise RuntimeError(f"Archiving failed: {', '.join(self.failed)}")
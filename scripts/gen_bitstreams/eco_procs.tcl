@@ -0,0 +1,45 @@
+
+# ECO helpers, sourced by eco_batch.tcl and by the persistent shell (QuartusShell)
+#
+# Needs ::quartus::chip_planner, ::quartus::project and an open project
+
+set had_failure 0
+
+proc set_info { node info value } {
+    global had_failure
+
+    set node_id [ get_node_by_name -name $node ]
+    if { $node_id == -1 } {
+        puts "FAIL: get_node_by_name -name $node"
+        set had_failure 1
+        return
+    }
+
+    set result [ set_node_info -node $node_id -info $info $value ]
+    if { $result == 0 } {
+        puts "FAIL"
+        set had_failure 1
+    } else {
+        puts "SET"
+    }
+}
+
+proc check_and_save { } {
+    global had_failure
+
+    puts ""
+    set drc_result [check_netlist_and_save]
+    if { $drc_result == 1 } {
+        puts "check_netlist_and_save: SUCCESS"
+    } else {
+        puts "check_netlist_and_save: FAIL"
+        set had_failure 1
+    }
+}
+
+proc snapshot { sof_src sof_dst } {
+    check_and_save
+
+    file copy -force $sof_src $sof_dst
+    puts "SNAPSHOT: $sof_dst"
+}
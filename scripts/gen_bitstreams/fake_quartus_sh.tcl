@@ -0,0 +1,70 @@
+
+# tclsh fake_quartus_sh.tcl
+#
+# Stand-in for `quartus_cdb -s`, for testing QuartusShell without Quartus;
+# the ECO commands are stubs which only check the project is open and record
+# the node infos. `crash ?rc?` exits the shell, as a crashed Quartus would.
+
+package provide ::quartus::chip_planner 1.0
+package provide ::quartus::project 1.0
+
+set project_open 0
+set node_ids [dict create]
+
+proc load_chip_planner_utility_commands { } { }
+
+proc _need_project { } {
+    if { !$::project_open } {
+        error "ERROR: There is no open project"
+    }
+}
+
+proc project_open { args } {
+    if { $::project_open } {
+        error "ERROR: A project is already open"
+    }
+    set ::project_open 1
+}
+
+proc project_close { } {
+    _need_project
+    set ::project_open 0
+}
+
+proc read_netlist { } {
+    _need_project
+}
+
+proc get_node_by_name { -name name } {
+    _need_project
+    if { ![dict exists $::node_ids $name] } {
+        dict set ::node_ids $name [dict size $::node_ids]
+    }
+    return [dict get $::node_ids $name]
+}
+
+proc set_node_info { -node node_id -info info value } {
+    _need_project
+    set ::node_info($node_id,$info) $value
+    return 1
+}
+
+proc check_netlist_and_save { } {
+    _need_project
+    return 1
+}
+
+proc crash { { rc 1 } } {
+    exit $rc
+}
+
+set cmd ""
+while { [gets stdin line] >= 0 } {
+    append cmd $line "\n"
+    if { [info complete $cmd] } {
+        if { [catch { uplevel #0 $cmd } res] } {
+            puts "Error: $res"
+        }
+        set cmd ""
+    }
+}
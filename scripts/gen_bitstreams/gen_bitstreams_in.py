@@ -9,6 +9,7 @@ import progressbar
 import psutil
 
 from EcoRunnerThread import EcoRunnerThread
+from MemoryScheduler import MemoryScheduler
 from PinInfoParser import PinInfoParser
 
 
@@ -25,24 +26,31 @@ class EcoRunnerThreadOut(EcoRunnerThread):
             while True:
                 pin_name = self.work_queue.get(block=False)
                 self.log_to_file(f">>> pin_name {pin_name} <<<")
+                if not self.begin_item(pin_name):
+                    continue
 
                 self.set_test_pin_loc("PIN_" + pin_name)
-                self.compile_fpga_project()
-                self.store_results(f"{pin_name}_2V5.zip")
-
-                self.eco('"I/O Standard"', f'"SSTL-15 Class II"')
-                self.store_results(f"{pin_name}_sstl15_class2.zip")
-
-                self.eco(
+                oct_par50 = (
                     '"On-Chip Termination"',
-                    f'"Parallel 50 Ohm with Calibration"',
-                    node="|base_project|test_pin~input",
+                    '"Parallel 50 Ohm with Calibration"',
+                    "|base_project|test_pin~input",
                 )
-                self.store_results(f"{pin_name}_sstl15_class2_term_par50.zip")
+                steps = [
+                    (
+                        [('"I/O Standard"', '"SSTL-15 Class II"')],
+                        f"{pin_name}_sstl15_class2.zip",
+                    ),
+                    ([oct_par50], f"{pin_name}_sstl15_class2_term_par50.zip"),
+                ]
+                self.compile_and_store(f"{pin_name}_2V5.zip", steps)
+
+                self.end_item()
 
         except Empty:
             self.f_log.write("> queue empty, thread exiting")
             return
+        finally:
+            self.close_shell()
 
 
 class WorkQueue(Queue):
@@ -78,9 +86,16 @@ def main():
 
     THREAD_COUNT = max(psutil.cpu_count(False) - 1, 1)
 
+    EcoRunnerThreadOut.scheduler = MemoryScheduler()
+    EcoRunnerThreadOut.open_journal()
+    EcoRunnerThreadOut.start_archiver()
     threads = [EcoRunnerThreadOut(idx, work_queue) for idx in range(THREAD_COUNT)]
     [thread.start() for thread in threads]
     [thread.join() for thread in threads]
+    try:
+        EcoRunnerThreadOut.stop_archiver()
+    finally:
+        EcoRunnerThreadOut.close_journal()
 
 
 if __name__ == "__main__":
@@ -9,6 +9,7 @@ import progressbar
 import psutil
 
 from EcoRunnerThread import EcoRunnerThread
+from MemoryScheduler import MemoryScheduler
 from PinInfoParser import PinInfoParser
 
 
@@ -25,89 +26,86 @@ class EcoRunnerThreadOut(EcoRunnerThread):
             while True:
                 pin_name = self.work_queue.get(block=False)
                 self.log_to_file(f">>> pin_name {pin_name} <<<")
+                if not self.begin_item(pin_name):
+                    continue
 
                 self.set_test_pin_loc("PIN_" + pin_name)
                 self.set_test_pin_io_std("2.5 V")
-                self.compile_fpga_project()
-                self.store_results(f"{pin_name}_2V5_on_chip_term.zip")
 
-                self.eco(
+                # all the 2.5 V variants in a single quartus_cdb session
+                oct_off = (
                     '"On-Chip Termination"',
-                    f'"Off"',
-                    node="|base_project|test_pin~output",
+                    '"Off"',
+                    "|base_project|test_pin~output",
                 )
-                self.store_results(f"{pin_name}_2V5_on_chip_term_off.zip")
+                steps = [([oct_off], f"{pin_name}_2V5_on_chip_term_off.zip")]
 
                 for pu in ["on", "off"]:
-                    self.eco('"Weak Pull Up"', f'"{pu}"')
+                    changes = [('"Weak Pull Up"', f'"{pu}"')]
 
                     for cur in ["4mA", "8mA", "12mA", "16mA"]:
-                        self.eco('"Current Strength"', f'"{cur}"')
-                        self.store_results(f"{pin_name}_2V5_{cur}_pu_{pu}_dly_no.zip")
+                        changes.append(('"Current Strength"', f'"{cur}"'))
+                        steps.append(
+                            (changes, f"{pin_name}_2V5_{cur}_pu_{pu}_dly_no.zip")
+                        )
+                        changes = []
 
-                self.eco('"Weak Pull Up"', f'"off"')
-                self.eco('"Current Strength"', '"4mA"')
+                changes = [('"Weak Pull Up"', '"off"'), ('"Current Strength"', '"4mA"')]
 
                 for dly in ["1", "2", "0"]:
-                    self.eco('"D5 Delay Chain"', f'"{dly}"')
-                    self.store_results(f"{pin_name}_2V5_4mA_pu_off_dly_{dly}.zip")
+                    changes.append(('"D5 Delay Chain"', f'"{dly}"'))
+                    steps.append((changes, f"{pin_name}_2V5_4mA_pu_off_dly_{dly}.zip"))
+                    changes = []
+
+                self.compile_and_store(f"{pin_name}_2V5_on_chip_term.zip", steps)
 
                 self.set_test_pin_io_std("SSTL-15")
-                self.compile_fpga_project()
-                self.store_results(f"{pin_name}_sstl15_default.zip")
+                self.compile_and_store(f"{pin_name}_sstl15_default.zip")
 
                 self.set_test_pin_io_std("SSTL-15 CLASS I")
-                self.compile_fpga_project()
-                self.store_results(f"{pin_name}_sstl15_class1_default.zip")
-
-                self.eco(
-                    '"On-Chip Termination"',
-                    f'"Off"',
-                    node="|base_project|test_pin~output",
-                )
+                changes = [oct_off]
+                steps = []
                 for cur in ["4mA", "6mA", "8mA", "10mA", "12mA"]:
-                    self.eco('"Current Strength"', f'"{cur}"')
-                    self.store_results(f"{pin_name}_sstl15_class1_term_off_{cur}.zip")
+                    changes.append(('"Current Strength"', f'"{cur}"'))
+                    steps.append(
+                        (changes, f"{pin_name}_sstl15_class1_term_off_{cur}.zip")
+                    )
+                    changes = []
+                self.compile_and_store(f"{pin_name}_sstl15_class1_default.zip", steps)
 
                 self.set_test_pin_io_std("SSTL-15 CLASS II")
-                self.compile_fpga_project()
-                self.store_results(f"{pin_name}_sstl15_class2_default.zip")
-
-                self.eco(
-                    '"On-Chip Termination"',
-                    f'"Off"',
-                    node="|base_project|test_pin~output",
-                )
+                changes = [oct_off]
+                steps = []
                 for cur in ["8mA", "16mA"]:
-                    self.eco('"Current Strength"', f'"{cur}"')
-                    self.store_results(f"{pin_name}_sstl15_class2_term_off_{cur}.zip")
+                    changes.append(('"Current Strength"', f'"{cur}"'))
+                    steps.append(
+                        (changes, f"{pin_name}_sstl15_class2_term_off_{cur}.zip")
+                    )
+                    changes = []
+                self.compile_and_store(f"{pin_name}_sstl15_class2_default.zip", steps)
 
                 if pins[pin_name].tx_rx_ch[-1] == "p":
                     # 1
                     if pins[pin_name].tx_rx_ch.find("DIFFIO_TX") == 0:
                         self.set_test_pin_io_std("LVDS")
-                        self.compile_fpga_project()
-                        self.store_results(f"{pin_name}_lvds.zip")
+                        self.compile_and_store(f"{pin_name}_lvds.zip")
                     else:
                         self.log_to_file(f"skipping LVDS for pin {pin_name}")
 
                     # 2
                     self.set_test_pin_io_std("DIFFERENTIAL 1.5-V SSTL")
-                    self.compile_fpga_project()
-                    self.store_results(f"{pin_name}_diff_sstl15_default.zip")
+                    self.compile_and_store(f"{pin_name}_diff_sstl15_default.zip")
 
                     # 3
                     self.set_test_pin_io_std("DIFFERENTIAL 1.5-V SSTL CLASS I")
-                    self.compile_fpga_project()
-                    self.store_results(f"{pin_name}_diff_sstl15_class1_default.zip")
+                    self.compile_and_store(f"{pin_name}_diff_sstl15_class1_default.zip")
 
                     # 3b
                     self.set_output_term_off()
 
                     for cur in ["4mA", "6mA", "8mA", "10mA", "12mA"]:
                         self.set_cur_strength(cur)
-                        self.compile_fpga_project()
-                        self.store_results(
+                        self.compile_and_store(
                             f"{pin_name}_diff_sstl15_class1_term_off_{cur}.zip"
                         )
 
@@ -116,25 +114,27 @@ class EcoRunnerThreadOut(EcoRunnerThread):
 
                     # 4
                     self.set_test_pin_io_std("DIFFERENTIAL 1.5-V SSTL CLASS II")
-                    self.compile_fpga_project()
-                    self.store_results(f"{pin_name}_diff_sstl15_class2_default.zip")
+                    self.compile_and_store(f"{pin_name}_diff_sstl15_class2_default.zip")
 
                     # 4b
                     self.set_output_term_off()
 
                     for cur in ["8mA", "16mA"]:
                         self.set_cur_strength(cur)
-                        self.compile_fpga_project()
-                        self.store_results(
+                        self.compile_and_store(
                             f"{pin_name}_diff_sstl15_class2_term_off_{cur}.zip"
                         )
 
                     self.set_output_term_default()
                     self.set_cur_strength_default()
 
+                self.end_item()
+
         except Empty:
             self.f_log.write("> queue empty, thread exiting")
             return
+        finally:
+            self.close_shell()
 
 
 class WorkQueue(Queue):
@@ -170,9 +170,16 @@ def main():
 
     THREAD_COUNT = max(psutil.cpu_count(False) - 1, 1)
 
+    EcoRunnerThreadOut.scheduler = MemoryScheduler()
+    EcoRunnerThreadOut.open_journal()
+    EcoRunnerThreadOut.start_archiver()
     threads = [EcoRunnerThreadOut(idx, work_queue) for idx in range(THREAD_COUNT)]
     [thread.start() for thread in threads]
     [thread.join() for thread in threads]
+    try:
+        EcoRunnerThreadOut.stop_archiver()
+    finally:
+        EcoRunnerThreadOut.close_journal()
 
 
 if __name__ == "__main__":
@@ -9,6 +9,7 @@ import progressbar
 import psutil
 
 from EcoRunnerThread import EcoRunnerThread
+from MemoryScheduler import MemoryScheduler
 from PinInfoParser import PinInfoParser
 
 
@@ -25,29 +26,39 @@ class EcoRunnerThreadOut(EcoRunnerThread):
             while True:
                 pin_name = self.work_queue.get(block=False)
                 self.log_to_file(f">>> pin_name {pin_name} <<<")
+                if not self.begin_item(pin_name):
+                    continue
 
                 self.set_test_pin_loc("PIN_" + pin_name)
                 self.set_test_pin_io_std("2.5 V")
-                self.compile_fpga_project()
-                self.store_results(f"{pin_name}_2V5_on_chip_term.zip")
 
-                self.eco(
+                # all the 2.5 V variants in a single quartus_cdb session
+                oct_off = (
                     '"On-Chip Termination"',
-                    f'"Off"',
-                    node="|base_project|test_pin~output",
+                    '"Off"',
+                    "|base_project|test_pin~output",
                 )
-                self.store_results(f"{pin_name}_2V5_on_chip_term_off.zip")
+                steps = [([oct_off], f"{pin_name}_2V5_on_chip_term_off.zip")]
 
                 for pu in ["on", "off"]:
-                    self.eco('"Weak Pull Up"', f'"{pu}"')
+                    changes = [('"Weak Pull Up"', f'"{pu}"')]
 
                     for cur in ["4mA", "8mA", "12mA", "16mA"]:
-                        self.eco('"Current Strength"', f'"{cur}"')
-                        self.store_results(f"{pin_name}_2V5_{cur}_pu_{pu}_dly_no.zip")
+                        changes.append(('"Current Strength"', f'"{cur}"'))
+                        steps.append(
+                            (changes, f"{pin_name}_2V5_{cur}_pu_{pu}_dly_no.zip")
+                        )
+                        changes = []
+
+                self.compile_and_store(f"{pin_name}_2V5_on_chip_term.zip", steps)
+
+                self.end_item()
 
         except Empty:
             self.f_log.write("> queue empty, thread exiting")
             return
+        finally:
+            self.close_shell()
 
 
 class WorkQueue(Queue):
@@ -83,9 +94,16 @@ def main():
 
     THREAD_COUNT = max(psutil.cpu_count(False) - 1, 1)
 
+    EcoRunnerThreadOut.scheduler = MemoryScheduler()
+    EcoRunnerThreadOut.open_journal()
+    EcoRunnerThreadOut.start_archiver()
     threads = [EcoRunnerThreadOut(idx, work_queue) for idx in range(THREAD_COUNT)]
     [thread.start() for thread in threads]
     [thread.join() for thread in threads]
+    try:
+        EcoRunnerThreadOut.stop_archiver()
+    finally:
+        EcoRunnerThreadOut.close_journal()
 
 
 if __name__ == "__main__":
@@ -12,6 +12,7 @@ import progressbar
 import psutil
 
 from EcoRunnerThread import EcoRunnerThread
+from MemoryScheduler import MemoryScheduler
 
 
 @dataclasses.dataclass
@@ -85,15 +86,20 @@ class EcoRunnerThreadPcie(EcoRunnerThread):
                 conf = self.work_queue.get(block=False)
 
                 self.log_to_file(f">>> conf {conf} <<<")
+                if not self.begin_item(conf.get_compact_str()):
+                    continue
 
                 self._modify_qsys_pcie(conf)
                 self.gen_qsys()
-                self.compile_fpga_project()
-                self.store_results(f"pcie_{conf.get_compact_str()}.zip")
+                self.compile_and_store(f"pcie_{conf.get_compact_str()}.zip")
+
+                self.end_item()
 
         except Empty:
             self.f_log.write("> queue empty, thread exiting")
             return
+        finally:
+            self.close_shell()
 
 
 class WorkQueue(Queue):
@@ -185,12 +191,20 @@ def main():
 
     work_queue = WorkQueue(configs)
 
-    # Jan, buy more RAM!
-    THREAD_COUNT = 4 # max(psutil.cpu_count(False) // 2, 1)
+    # the number of the compilations (and Qsys generations) running at once is
+    # limited by the memory, no ECOs are run
+    THREAD_COUNT = max(psutil.cpu_count(False) - 1, 1)
 
+    EcoRunnerThreadPcie.scheduler = MemoryScheduler()
+    EcoRunnerThreadPcie.open_journal()
+    EcoRunnerThreadPcie.start_archiver()
     threads = [EcoRunnerThreadPcie(idx, work_queue) for idx in range(THREAD_COUNT)]
     [thread.start() for thread in threads]
     [thread.join() for thread in threads]
+    try:
+        EcoRunnerThreadPcie.stop_archiver()
+    finally:
+        EcoRunnerThreadPcie.close_journal()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from JobJournal import JobJournal
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    calls = []
+    checksum = JobJournal.checksum
+    monkeypatch.setattr(
+        JobJournal,
+        "checksum",
+        staticmethod(lambda filename: calls.append(filename) or checksum(filename)),
+    )
+
+    (tmp_path / "R32_2V5.zip").write_bytes(b"zip")
+    journal = JobJournal(str(tmp_path / "journal.jsonl"), str(tmp_path))
+    journal.record_result("R32_2V5.zip")
+    journal.record_item("R32", ["R32_2V5.zip"])
+    journal.close()
+
+    journal = JobJournal(str(tmp_path / "journal.jsonl"), str(tmp_path))
+    journal.calls = calls
+    calls.clear()
+    yield journal
+    journal.close()
+
+
+def test_checksum_once(journal):
+    assert journal.is_result_done("R32_2V5.zip")
+    assert journal.is_item_done("R32")
+    assert journal.is_result_done("R32_2V5.zip")
+    assert len(journal.calls) == 1
+
+
+def test_changed_result(journal):
+    assert journal.is_result_done("R32_2V5.zip")
+
+    filename = os.path.join(journal.results_dir, "R32_2V5.zip")
+    with open(filename, "wb") as f:
+        f.write(b"ZIP")
+    os.utime(filename, ns=(1, 1))
+
+    assert not journal.is_result_done("R32_2V5.zip")
+    assert not journal.is_item_done("R32")
+    assert len(journal.calls) == 2
+
+    os.remove(filename)
+    assert not journal.is_result_done("R32_2V5.zip")
@@ -0,0 +1,38 @@
+import sys
+from collections import namedtuple
+
+import psutil
+import pytest
+
+from MemoryScheduler import MemoryScheduler
+
+Swap = namedtuple("Swap", ["used"])
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(MemoryScheduler, "POLL_INTERVAL", 0.05)
+    return MemoryScheduler(job_peak=1, reserve=0)
+
+
+def test_swap_growth_holds_admission(scheduler, monkeypatch):
+    swap_used = iter(range(0, 1 << 40, 1 << 30))
+    monkeypatch.setattr(psutil, "swap_memory", lambda: Swap(next(swap_used)))
+
+    # 1 GiB more swap at every sample
+    scheduler.call([sys.executable, "-c", "import time; time.sleep(0.3)"])
+    assert scheduler.swap_growth > MemoryScheduler.SWAP_GROWTH_RATE
+
+    scheduler._running[-1] = 0
+    assert not scheduler._fits()
+
+    scheduler.swap_growth = 0.0
+    assert scheduler._fits()
+
+
+def test_failed_start_is_not_learned(scheduler):
+    with pytest.raises(OSError):
+        scheduler.call(["/nonexistent/job"])
+
+    assert scheduler.learned_peak is None
+    assert scheduler._running == {}
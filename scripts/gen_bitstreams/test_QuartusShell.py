@@ -0,0 +1,49 @@
+import os
+import shutil
+
+import pytest
+
+from QuartusShell import QuartusShell, QuartusShellCrashed
+
+FAKE_SHELL_CMD = [
+    "tclsh",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_quartus_sh.tcl"),
+]
+
+pytestmark = pytest.mark.skipif(shutil.which("tclsh") is None, reason="no tclsh")
+
+
+@pytest.fixture
+def shell(tmp_path):
+    init = "package require ::quartus::project\nset inits [incr inits]"
+    with QuartusShell(init, cmd=FAKE_SHELL_CMD, script_dir=tmp_path) as shell:
+        yield shell
+
+
+def test_run_after_kill(shell):
+    # e.g. after a timeout, the shell is killed and not respawned
+    shell._kill()
+
+    assert shell.run("expr 6 * 7")[1] == "42"
+    assert shell.run("set inits")[1] == "1"
+    assert shell.nr_spawns == 2
+
+
+def test_run_after_exit(shell):
+    # the state of the shell is lost, the caller has to know
+    shell.proc.kill()
+    shell.proc.wait()
+
+    with pytest.raises(QuartusShellCrashed):
+        shell.run("expr 6 * 7")
+
+    assert shell.run("expr 6 * 7")[1] == "42"
+    assert shell.nr_spawns == 2
+
+
+def test_crash_respawns(shell):
+    with pytest.raises(QuartusShellCrashed):
+        shell.run("crash 3")
+
+    assert shell.run("expr 6 * 7")[1] == "42"
+    assert shell.nr_spawns == 2